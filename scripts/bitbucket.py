@@ -1,13 +1,17 @@
 from __future__ import annotations
+from abc import ABC, abstractmethod
 import json
 import aiohttp
 import asyncio
 import os
 import re
-from urllib.parse import urlparse
+from urllib.parse import urlencode, urlparse, quote
 
-from typing import AsyncIterable, TypedDict, Literal, Iterable
+from typing import AsyncIterable, Awaitable, Callable, TypedDict, Literal, Iterable
 
+from .governor import governor_for
+from .ratelimit import limiter_for
+from .retry import with_retry
 from .utils import drop_falsy, err
 
 
@@ -15,6 +19,7 @@ type QueryScope = Literal["METADATA", "TAGS", "BRANCHES"]
 type Url = str
 type Sha = str
 type IsoTimestamp = str
+type ReadmeHint = tuple[str | None, Url | None]  # the key it's valid for, the README url
 
 
 class RepoMetadata(TypedDict, total=False):
@@ -48,6 +53,9 @@ class RepoInfo(TypedDict):
     metadata: RepoMetadata
     tags: AsyncIterable[TagInfo]
     branches: AsyncIterable[BranchInfo]
+    branch: Callable[[str], Awaitable[BranchInfo | None]]
+    tags_with_prefix: Callable[[str], AsyncIterable[TagInfo]]
+    readme_key: str | None  # ref. ReadmeHint
 
 
 BITBUCKET_API_URL = "https://api.bitbucket.org/2.0"
@@ -56,19 +64,40 @@ _readme_filenames = {
     'readme.markdown', 'readme.textile', 'readme.creole', 'readme.rst'
 }
 
+# Ask only for what we read, in pages as large as Bitbucket allows, and for
+# refs newest first like GitHub does.  Bitbucket carries these parameters
+# over to the `next` links.
+PAGELEN = 100
+REPOSITORY_FIELDS = ",".join((
+    "uuid", "name", "description", "website", "updated_on", "mainbranch.name",
+    "owner.nickname", "owner.username", "links.issues.href",
+))
+REF_FIELDS = "name,target.hash,target.date"
+REFS_FIELDS = f"next,{','.join(f'values.{field}' for field in REF_FIELDS.split(','))}"
+SRC_FIELDS = "next,values.path,values.type"
+
 if not os.getenv("BITBUCKET_TOKEN"):
     err(
         "Note: BITBUCKET_TOKEN environment variable is not set. "
         "Running anonymously."
     )
 
+
 async def fetch_json(session: aiohttp.ClientSession, url: str) -> dict:
     headers = {}
     if token := os.getenv("BITBUCKET_TOKEN"):
         headers["Authorization"] = f"Bearer {token}"
-    async with session.get(url, headers=headers) as resp:
-        resp.raise_for_status()
-        return await resp.json()
+
+    limiter = limiter_for(session, url)
+
+    async def get():
+        await limiter.acquire()
+        async with governor_for(session, url).slot():
+            async with session.get(url, headers=headers) as resp:
+                limiter.update(resp.headers)
+                resp.raise_for_status()
+                return await resp.json()
+    return await with_retry(get)
 
 
 def parse_owner_repo(url: str):
@@ -79,11 +108,24 @@ def parse_owner_repo(url: str):
     return path_parts[0], path_parts[1]
 
 
-async def fetch_repo_metadata(session: aiohttp.ClientSession, owner: str, repo: str) -> RepoMetadata:
-    url = f"{BITBUCKET_API_URL}/repositories/{owner}/{repo}"
+async def fetch_repo_metadata(
+    session: aiohttp.ClientSession,
+    owner: str,
+    repo: str,
+    readme_hint: ReadmeHint | None = None
+) -> tuple[RepoMetadata, str | None]:
+    """
+    Fetch the metadata, and the key under which to remember the README
+    location.  We only look for the README if `readme_hint` is outdated.
+    """
+    url = f"{BITBUCKET_API_URL}/repositories/{owner}/{repo}?fields={REPOSITORY_FIELDS}"
     data = await fetch_json(session, url)
     default_branch = data.get("mainbranch", {}).get("name", "master")
-    readme_url = await find_readme_url(session, owner, repo, default_branch)
+    readme_key = data.get("updated_on")
+    if readme_hint and readme_key and readme_hint[0] == readme_key:
+        readme_url = readme_hint[1]
+    else:
+        readme_url = await find_readme_url(session, owner, repo, default_branch)
     return drop_falsy({
         "id": data.get("uuid"),
         "name": data.get("name"),
@@ -97,14 +139,17 @@ async def fetch_repo_metadata(session: aiohttp.ClientSession, owner: str, repo:
         "issues": data.get("links", {}).get("issues", {}).get("href"),
         "donate": None,  # Not available
         "default_branch": default_branch,
-    })
+    }), readme_key
 
 
 async def find_readme_url(session, owner, repo, branch) -> Url | None:
     """
     Fetch the root directory file listing and return the raw URL of the README if found.
     """
-    files_url = f"{BITBUCKET_API_URL}/repositories/{owner}/{repo}/src/{branch}/?max_depth=1"
+    files_url = (
+        f"{BITBUCKET_API_URL}/repositories/{owner}/{repo}/src/{branch}/"
+        f"?max_depth=1&pagelen={PAGELEN}&fields={SRC_FIELDS}"
+    )
     files_data = await fetch_json(session, files_url)
     entries = files_data.get("values", [])
     for entry in entries:
@@ -113,99 +158,183 @@ async def find_readme_url(session, owner, repo, branch) -> Url | None:
     return None
 
 
-class TagPager:
-    def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str):
+def refs_url(owner: str, repo: str, kind: str, bbql: str | None = None) -> Url:
+    """The first page of the `kind` ("tags", "branches") refs, newest first."""
+    params: dict[str, str | int] = {
+        "pagelen": PAGELEN, "sort": "-target.date", "fields": REFS_FIELDS
+    }
+    if bbql:
+        params["q"] = bbql
+    return (
+        f"{BITBUCKET_API_URL}/repositories/{owner}/{repo}/refs/{kind}"
+        f"?{urlencode(params, safe=',.', quote_via=quote)}"
+    )
+
+
+class _Pager(ABC):
+    _next_url: Url | None
+    _cache: list
+    _lock: asyncio.Lock
+
+    def __aiter__(self):
+        return self._generator()
+
+    async def _generator(self):
+        # Iterate by index: concurrent iterations share the pages fetched so
+        # far, and only one of them fetches the next page.
+        i = 0
+        while True:
+            while i < len(self._cache):
+                yield self._cache[i]
+                i += 1
+            if not self._next_url:
+                break
+            async with self._lock:
+                if i == len(self._cache) and self._next_url:
+                    await self._fetch_next_page()
+
+    @abstractmethod
+    async def _fetch_next_page(self) -> None:
+        """Append the next page to `_cache` and advance `_next_url`."""
+
+
+class TagPager(_Pager):
+    def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str, prefix: str = ""):
         self._session = session
         self.owner = owner
         self.repo = repo
-        self._next_url = f"{BITBUCKET_API_URL}/repositories/{owner}/{repo}/refs/tags"
+        bbql = None
+        if prefix:
+            # BBQL has no "starts with", "~" matches anywhere in the name
+            bbql = 'name ~ "{}"'.format(prefix.replace('\\', '\\\\').replace('"', '\\"'))
+        self._next_url = refs_url(owner, repo, "tags", bbql)
         self._cache = []
+        self._lock = asyncio.Lock()
+
+    async def _fetch_next_page(self) -> None:
+        assert self._next_url
+        data = await fetch_json(self._session, self._next_url)
+        self._cache.extend(
+            {
+                "name": tag["name"],
+                "url": f"https://bitbucket.org/{self.owner}/{self.repo}/get/{tag['name']}.zip",
+                "date": tag["target"]["date"][:19].replace('T', ' '),
+                "sha": tag.get("target", {}).get("hash", ""),
+            }
+            for tag in data.get("values", [])
+        )
+        self._next_url = data.get("next")
+
+
+class PrefixedTags:
+    def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str):
+        self._session = session
+        self.owner = owner
+        self.repo = repo
+        self._pagers: dict[str, TagPager] = {}
 
-    def __aiter__(self):
-        return self._generator()
+    def __call__(self, prefix: str) -> TagPager:
+        """Return the tags matching `prefix`, filtered on the server."""
+        if prefix not in self._pagers:
+            self._pagers[prefix] = TagPager(self._session, self.owner, self.repo, prefix=prefix)
+        return self._pagers[prefix]
 
-    async def _generator(self):
-        for tag in self._cache:
-            yield tag
-
-        while self._next_url:
-            data = await fetch_json(self._session, self._next_url)
-            new_tags = [
-                {
-                    "name": tag["name"],
-                    "url": f"https://bitbucket.org/{self.owner}/{self.repo}/get/{tag['name']}.zip",
-                    "date": tag["target"]["date"][:19].replace('T', ' '),
-                    "sha": tag.get("target", {}).get("hash", ""),
-                }
-                for tag in data.get("values", [])
-            ]
-            self._cache.extend(new_tags)
-            self._next_url = data.get("next")
-
-            for tag_obj in new_tags:
-                yield tag_obj
-
-
-class BranchesPager:
+
+class BranchesPager(_Pager):
     def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str):
         self._session = session
         self.owner = owner
         self.repo = repo
-        self._next_url = f"{BITBUCKET_API_URL}/repositories/{owner}/{repo}/refs/branches"
+        self._next_url = refs_url(owner, repo, "branches")
         self._cache = []
+        self._lock = asyncio.Lock()
 
-    def __aiter__(self):
-        return self._generator()
+    async def _fetch_next_page(self) -> None:
+        assert self._next_url
+        data = await fetch_json(self._session, self._next_url)
+        self._cache.extend(
+            grab_branch(self.owner, self.repo, branch) for branch in data.get("values", [])
+        )
+        self._next_url = data.get("next")
 
-    async def _generator(self):
-        for branch in self._cache:
-            yield branch
-
-        while self._next_url:
-            data = await fetch_json(self._session, self._next_url)
-            new_branches = [
-                {
-                    "name": branch["name"],
-                    "version": re.sub(r"\D", ".", branch.get("target", {}).get("date", "")[:19].replace('T', ' ')),
-                    "url": f"https://bitbucket.org/{self.owner}/{self.repo}/get/{branch['name']}.zip",
-                    "date": branch.get("target", {}).get("date", "")[:19].replace('T', ' '),
-                    "sha": branch.get("target", {}).get("hash", ""),
-                }
-                for branch in data.get("values", [])
-            ]
-            self._cache.extend(new_branches)
-            self._next_url = data.get("next")
-
-            for branch_obj in new_branches:
-                yield branch_obj
+
+def grab_branch(owner: str, repo: str, branch: dict) -> BranchInfo:
+    date = branch.get("target", {}).get("date", "")[:19].replace('T', ' ')
+    return {
+        "name": branch["name"],
+        "version": re.sub(r"\D", ".", date),
+        "url": f"https://bitbucket.org/{owner}/{repo}/get/{branch['name']}.zip",
+        "date": date,
+        "sha": branch.get("target", {}).get("hash", ""),
+    }
+
+
+class BranchLookup:
+    def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str):
+        self._session = session
+        self.owner = owner
+        self.repo = repo
+        self._cache: dict[str, BranchInfo | None] = {}
+
+    async def __call__(self, name: str) -> BranchInfo | None:
+        """Return the branch `name` or None if it doesn't exist."""
+        if name not in self._cache:
+            url = (
+                f"{BITBUCKET_API_URL}/repositories/{self.owner}/{self.repo}"
+                f"/refs/branches/{quote(name, safe='')}?fields={REF_FIELDS}"
+            )
+            try:
+                data = await fetch_json(self._session, url)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 404:
+                    raise
+                data = None
+            self._cache[name] = grab_branch(self.owner, self.repo, data) if data else None
+        return self._cache[name]
 
 
 async def fetch_bitbucket_info(
-    session: aiohttp.ClientSession, bitbucket_url: str, scopes: Iterable[QueryScope]
+    session: aiohttp.ClientSession,
+    bitbucket_url: str,
+    scopes: Iterable[QueryScope],
+    branches: Iterable[str] = (),
+    tag_prefixes: Iterable[str] = (),
+    readme_hint: ReadmeHint | None = None
 ) -> RepoInfo:
     owner, repo = parse_owner_repo(bitbucket_url)
     tags = TagPager(session, owner, repo)
-    branches = BranchesPager(session, owner, repo)
+    branches_pager = BranchesPager(session, owner, repo)
+    branch = BranchLookup(session, owner, repo)
+    tags_with_prefix = PrefixedTags(session, owner, repo)
 
     metadata_task = (
-        fetch_repo_metadata(session, owner, repo)
+        fetch_repo_metadata(session, owner, repo, readme_hint)
         if "METADATA" in scopes
-        else ready({})
+        else ready(({}, None))
     )
     tags_task = (
         async_next_or_none(tags._generator()) if "TAGS" in scopes else ready()
     )
     branches_task = (
-        async_next_or_none(branches._generator())
+        async_next_or_none(branches_pager._generator())
         if "BRANCHES" in scopes
         else ready()
     )
-    metadata, _, _ = await asyncio.gather(metadata_task, tags_task, branches_task)
+    (metadata, readme_key), *_ = await asyncio.gather(
+        metadata_task,
+        tags_task,
+        branches_task,
+        *map(branch, branches),
+        *(async_next_or_none(tags_with_prefix(prefix)._generator()) for prefix in tag_prefixes)
+    )
 
     return {
         "metadata": metadata,
         "tags": tags,
-        "branches": branches,
+        "branches": branches_pager,
+        "branch": branch,
+        "tags_with_prefix": tags_with_prefix,
+        "readme_key": readme_key,
     }
 
 
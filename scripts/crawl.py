@@ -2,28 +2,85 @@ import aiohttp
 import argparse
 import asyncio
 from collections import defaultdict
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
+from functools import partial
+import hashlib
 import json
 import os
+import signal
 import sys
-from typing import Iterable, Literal, NotRequired, Required, TypedDict
+import time
+from weakref import WeakKeyDictionary
+from typing import (
+    Callable, Iterable, Literal, Mapping, MutableMapping, NotRequired, Required, TypedDict
+)
 
 
 from .bitbucket import fetch_bitbucket_info
 from .generate_registry import Registry, PackageEntry as PackageEntryV1
-from .github import fetch_github_info, is_semver, rate_limit_info, strip_possible_prefix, QueryScope
+from .github import (
+    branches_of_heads, fetch_github_heads, fetch_github_info, fetch_rate_limit, is_semver,
+    rate_limit_info, strip_possible_prefix, token_pool, QueryScope, RateLimitExhausted,
+    RateLimitInfo, ReadmeHint, RepoInfo
+)
 from .gitlab import fetch_gitlab_info
-from .utils import resolve_url, update_url
+from .governor import governors_of
+from .ratelimit import limiters_of
+from .retry import deadline
+from .schedule import Schedule
+from .utils import parse_timestamp, resolve_url, update_url
+from .workspace import encode_entry, open_workspace
 import traceback
 
 
 DEFAULT_REGISTRY = "./registry.json"
 DEFAULT_WORKSPACE = "./workspace.json"
+HOUR = 3600  # seconds
+DAY = 24 * HOUR
+# Packages whose heads did not move are only probed.  Still, do a full crawl
+# every now and then to pick up metadata changes (stars, description, ...).
+# Quiet packages are crawled every `--max-interval` (plus jitter), so allow
+# for a few probes of them in between.
+PROBES_PER_FULL_CRAWL = 4
+# Save the workspace while crawling so that a killed run doesn't lose
+# everything.  (Ref: Checkpointer)
+CHECKPOINT_EVERY = 100     # results
+CHECKPOINT_INTERVAL = 60   # seconds
+# Size each run by the GitHub GraphQL points left.  (Ref: Budget)
+BUDGET_RESERVE = 500        # points we leave for others using the same token
+ESTIMATED_COST_PER_PACKAGE = 2
+MIN_COST_SAMPLES = 20       # finished packages before we trust our own measurement
+# Learn how often a package changes and crawl it accordingly.  (Ref: next_interval)
+MIN_INTERVAL = 1 * HOUR
+MAX_INTERVAL = 24 * HOUR
+ARCHIVED_INTERVAL = 7 * DAY
+CHANGE_FRACTION = 1 / 48    # crawl this often per expected time between two changes
+CHANGE_EWMA_ALPHA = 0.3     # weight of the latest time between changes
+CHANGE_HISTORY = 10         # timestamps of observed changes we keep
+# Keep the load of the runs even.  (Ref: jittered and next_packages_to_crawl)
+JITTER = 0.2                # spread intervals by +/- 10%
+RUN_EVERY = 15 * 60         # the cron schedule of the crawl workflow
+WORK_AHEAD = 2 * HOUR       # crawl packages due within this window early
+# Stop crawling a hub that is down.  (Ref: CircuitBreaker)
+BREAKER_THRESHOLD = 5       # transport errors in a row
+BREAKER_COOLDOWN = 120      # seconds before we try again
+PACKAGE_DEADLINE = 120      # seconds we may spend retrying for one package
+# A request to a hub that hangs fails long before the PACKAGE_DEADLINE, and
+# the breaker counts it as a transport error.
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+# The crawl is a pipeline: we queue the packages for a fixed set of workers,
+# and a single writer applies their results to the workspace.  (Ref: main_)
+WORKERS = 64
+SHARED_INFOS = 2 * WORKERS  # finished repository infos kept for other packages (ref: fetch_info)
+PROGRESS_EVERY = 100        # results
+PROGRESS_INTERVAL = 30      # seconds
 
 type PackageName = str
 type Url = str
 type IsoTimestamp = str
+type Epoch = int  # seconds, the workspace converts from/to IsoTimestamp on load/save
 type Version = str
+type Sha = str
 type BuildDescriptor = str
 type Platform = Literal["*", "windows", "osx", "linux"]
 type ReleaseDescription = dict
@@ -35,6 +92,7 @@ class Release(TypedDict, total=False):
     version: Version
     url: Url
     date: IsoTimestamp
+    sha: NotRequired[Sha]              # of the tag or branch we took it from
     libraries: NotRequired[list[str]]  # ? really, actually not used
 
 
@@ -48,19 +106,38 @@ class PackageEntry(TypedDict, total=False):
     schema_version: str
 
     tombstoned: NotRequired[bool]       # fetching the repository failed
-    removed: NotRequired[IsoTimestamp]  # not listed in the registry anymore
+    removed: NotRequired[Epoch]         # not listed in the registry anymore
     invalid: NotRequired[bool]
-    first_seen: IsoTimestamp
-    last_seen: IsoTimestamp
-    next_crawl: IsoTimestamp
-    last_modified: IsoTimestamp
-    failing_since: IsoTimestamp
+    first_seen: Epoch
+    last_seen: Epoch
+    next_crawl: Epoch
+    last_modified: Epoch
+    last_changed: Epoch                 # when a crawl last changed what the channel shows
+    failing_since: Epoch
     fail_reason: str
+    last_crawled: Epoch                 # last full crawl, not just a probe
+    heads: dict[Url, str]               # per hub url, ref. github.grab_heads
+    fingerprint: str                    # of the registry entry we crawled
+    readmes: dict[Url, ReadmeHint]      # where the README was, per hub url
+    tag_depths: dict[Url, dict[str, int]]  # how deep into the tags the version was, per prefix
+    changes: list[Epoch]                # when we saw the releases change, oldest first
+    change_interval: int                # EWMA of the seconds between changes
+    archived_at: IsoTimestamp | None
+
+
+# Fields of a PackageEntry only the crawler cares about (ref: channel_view)
+CRAWL_STATE_FIELDS = frozenset({
+    "first_seen", "last_seen", "next_crawl", "last_crawled", "last_changed",
+    "heads", "fingerprint", "readmes", "tag_depths", "changes", "change_interval",
+})
+
+type IntervalBounds = tuple[int, int]  # min, max seconds between two crawls
 
 
 class Workspace(TypedDict):
-    packages: dict[PackageName, PackageEntry]
+    packages: MutableMapping[PackageName, PackageEntry]
     dependencies: list[PackageEntry]
+    schedule: NotRequired[Schedule]  # built on load, not stored
 
 
 class HeartAttack(Exception):
@@ -68,11 +145,29 @@ class HeartAttack(Exception):
     pass
 
 
+class BudgetExhausted(Exception):
+    """Raised instead of crawling a package when the run's budget is spent."""
+    pass
+
+
+class HubDown(Exception):
+    """Raised instead of crawling a package when its hub is not reachable."""
+    pass
+
+
 def err(*args, **kwargs) -> None:
     print(*args, **kwargs, file=sys.stderr)
 
 
-async def main(registry: str, workspace: str, name: str | None, limit: int = 200) -> None:
+async def main(
+    registry: str,
+    workspace: str,
+    name: str | None,
+    limit: int = 200,
+    interval_bounds: IntervalBounds = (MIN_INTERVAL, MAX_INTERVAL),
+    workers: int = WORKERS,
+    time_limit: float | None = None
+) -> None:
     if not os.path.exists(registry):
         err(f"FATAL: Registry file '{registry}' does not exist.")
         sys.exit(1)
@@ -83,146 +178,483 @@ async def main(registry: str, workspace: str, name: str | None, limit: int = 200
         err(f"FATAL: Could not read registry file '{registry}': {e}")
         sys.exit(1)
 
-    if os.path.exists(workspace):
-        with open(workspace, 'r') as ws_file:
-            workspace_data = json.load(ws_file)
-    else:
-        workspace_data = {"packages": {}, "dependencies": []}
-
+    # Turn SIGTERM (e.g. a cancelled or timed out workflow) into a cancellation
+    # so that we still save what we have crawled so far.  SIGINT is already
+    # handled like that by `asyncio.run`.
+    main_task = asyncio.current_task()
+    assert main_task
     try:
-        await main_(registry_data, workspace_data, name, limit)
-    finally:
-        with open(workspace, 'w') as ws_file:
-            json.dump(workspace_data, ws_file, indent=2)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    except NotImplementedError:  # Windows
+        pass
+
+    with open_workspace(workspace) as store:
+        workspace_data = store.load()
+        checkpointer = Checkpointer(lambda: store.save(workspace_data))
+        try:
+            await main_(
+                registry_data, workspace_data, name, limit, checkpointer, interval_bounds,
+                workers, time_limit
+            )
+        except asyncio.CancelledError:
+            err("Interrupted.  Saving the results we have so far.")
+            raise
+        finally:
+            store.save(workspace_data)
 
 
-async def main_(registry: Registry, workspace: Workspace, name: str | None, limit: int) -> None:
+class Checkpointer:
+    """
+    Save the workspace after every `every` results, or if `interval` seconds
+    have passed since the last save, whichever comes first.
+    """
+    def __init__(
+        self,
+        save: Callable[[], None],
+        every: int = CHECKPOINT_EVERY,
+        interval: float = CHECKPOINT_INTERVAL
+    ):
+        self._save = save
+        self.every = every
+        self.interval = interval
+        self._pending = 0
+        self._last_save = time.monotonic()
+
+    def tick(self) -> None:
+        self._pending += 1
+        if (
+            self._pending >= self.every
+            or time.monotonic() - self._last_save >= self.interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            self._save()
+        self._pending = 0
+        self._last_save = time.monotonic()
+
+
+async def main_(
+    registry: Registry,
+    workspace: Workspace,
+    name: str | None,
+    limit: int,
+    checkpointer: Checkpointer | None = None,
+    interval_bounds: IntervalBounds = (MIN_INTERVAL, MAX_INTERVAL),
+    workers: int = WORKERS,
+    time_limit: float | None = None
+) -> None:
     name_requested = bool(name)
-    if name:
-        for entry in registry["packages"]:
-            if entry.get("name") == name:
-                tocrawl = [entry]
-                break
+    budget: Budget | None = None
+    async with aiohttp.ClientSession(timeout=REQUEST_TIMEOUT) as session:
+        if name:
+            for entry in registry["packages"]:
+                if entry.get("name") == name:
+                    tocrawl = [entry]
+                    break
+            else:
+                err(f"Package '{name}' not found in registry.")
+                return
         else:
-            err(f"Package '{name}' not found in registry.")
-            return
-    else:
-        maintenance(registry, workspace)
-        tocrawl = next_packages_to_crawl(registry, workspace, limit=limit)
-
-    async with aiohttp.ClientSession() as session:
-        tasks = [
-            crawl(
-                session,
-                package,
-                workspace["packages"].get(name, {"name": name})
+            maintenance(registry, workspace)
+            try:
+                budget = Budget(await fetch_rate_limit(session))
+            except Exception as e:
+                err(f"Could not fetch the GitHub rate limit: {e}")
+            else:
+                affordable = budget.packages_left()
+                if affordable < limit:
+                    print(
+                        f"GitHub budget: {budget.remaining()} points left, "
+                        f"enough for about {affordable} packages."
+                    )
+                    limit = affordable
+            tocrawl = next_packages_to_crawl(registry, workspace, limit=limit)
+
+        breakers: defaultdict[str, CircuitBreaker] = defaultdict(CircuitBreaker)
+        workers = max(1, min(workers, len(tocrawl)))
+        progress = Progress(len(tocrawl), session)
+        stop_at = time.monotonic() + time_limit if time_limit else None
+        todo: asyncio.Queue[PackageEntryV1 | None] = asyncio.Queue(maxsize=workers)
+        results: asyncio.Queue[PackageEntry | Exception | None] = asyncio.Queue()
+
+        # Packages being crawled haven't paid for all their queries yet
+        in_flight = 0
+
+        def stop_reason() -> str | None:
+            if budget and budget.exhausted(in_flight):
+                return "GitHub budget exhausted"
+            if stop_at and time.monotonic() >= stop_at:
+                return "Time limit reached"
+            return None
+
+        async def produce() -> None:
+            for i, package in enumerate(tocrawl):
+                if reason := stop_reason():
+                    err(f"{reason}, not starting {len(tocrawl) - i} packages.")
+                    break
+                await todo.put(package)
+            for _ in range(workers):
+                await todo.put(None)
+
+        async def work() -> None:
+            nonlocal in_flight
+            while (package := await todo.get()) is not None:
+                # Decide as late as possible whether to start another package.
+                if stop_reason():
+                    continue
+                name = package["name"]
+                result: PackageEntry | Exception
+                in_flight += 1
+                try:
+                    result = await crawl(
+                        session,
+                        package,
+                        workspace["packages"].get(name, {"name": name}),
+                        probe=not name_requested,
+                        budget=budget,
+                        interval_bounds=interval_bounds,
+                        breakers=breakers
+                    )
+                except (BudgetExhausted, HubDown) as e:
+                    result = e
+                finally:
+                    in_flight -= 1
+                await results.put(result)
+
+        async def write() -> None:
+            # The only task touching the workspace while we crawl
+            while (result := await results.get()) is not None:
+                progress.tick(result)
+                if isinstance(result, Exception):
+                    # Leave the package as is, it stays due for the next run.
+                    continue
+                workspace["packages"][result["name"]] = result
+                schedule_of(workspace).update(result["name"], result["next_crawl"])
+                if budget:
+                    budget.record()
+                if checkpointer:
+                    checkpointer.tick()
+                if name_requested:
+                    print(json.dumps(encode_entry(result), indent=2, ensure_ascii=False))
+
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(produce())
+            tg.create_task(write())
+            await asyncio.gather(*(tg.create_task(work()) for _ in range(workers)))
+            await results.put(None)
+
+        if progress.skipped:
+            err(f"GitHub budget exhausted, skipped {progress.skipped} packages.")
+        if progress.hub_down:
+            down = ", ".join(hub for hub, breaker in breakers.items() if breaker.is_open())
+            err(
+                f"Skipped {progress.hub_down} packages because their hub was down "
+                f"({down or 'recovered'})."
             )
-            for package in tocrawl
-            if (name := package["name"])
-        ]
-        results = await asyncio.gather(*tasks)
-        for new_entry in results:
-            workspace["packages"][new_entry["name"]] = new_entry
-            if name_requested:
-                print(json.dumps(new_entry, indent=2, ensure_ascii=False))
+        governors = governors_of(session)
+        limiters = limiters_of(session)
 
     print("---")
     print(f"{len(workspace['packages'].keys())} packages in db.")
 
     if len(tocrawl) > 0:
         print("GitHub", rate_limit_info)
+        if len(token_pool().tokens) > 1:
+            for line in token_pool().report():
+                print(line)
+        for limiter in limiters:
+            print(limiter.report())
+        if budget:
+            print(budget.report())
+        for governor in governors:
+            print(governor.report())
+
+
+class Progress:
+    """Count the results of a run and report every now and then."""
+    def __init__(
+        self,
+        total: int,
+        session: aiohttp.ClientSession,
+        every: int = PROGRESS_EVERY,
+        interval: float = PROGRESS_INTERVAL
+    ):
+        self.total = total
+        self.session = session
+        self.every = every
+        self.interval = interval
+        self.done = 0
+        self.failing = 0
+        self.skipped = 0
+        self.hub_down = 0
+        self.started = self.last_report = time.monotonic()
+
+    def tick(self, result: PackageEntry | Exception) -> None:
+        if isinstance(result, BudgetExhausted):
+            self.skipped += 1
+        elif isinstance(result, HubDown):
+            self.hub_down += 1
+        elif not isinstance(result, Exception):
+            self.done += 1
+            if "failing_since" in result:
+                self.failing += 1
+        finished = self.done + self.skipped + self.hub_down
+        now = time.monotonic()
+        if finished < self.total and (
+            finished % self.every == 0 or now - self.last_report >= self.interval
+        ):
+            self.last_report = now
+            print(self.report(finished, now))
+
+    def report(self, finished: int, now: float) -> str:
+        rate = self.done / max(now - self.started, 0.001)
+        windows = ", ".join(
+            f"{governor.host} {int(governor.window)}" for governor in governors_of(self.session)
+        )
+        return (
+            f"[{finished}/{self.total}] {rate:.1f} packages/s, {self.failing} failing"
+            + (f"; concurrency {windows}" if windows else "")
+        )
+
+
+class CircuitBreaker:
+    """
+    Stop crawling a hub after `threshold` transport errors in a row.
+
+    While the breaker is open, `allow()` says no.  After `cooldown` seconds
+    it is half-open and lets packages through again: the next success closes
+    it, the next failure opens it right away.
+    """
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        return self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self, hub: str) -> None:
+        self.failures += 1
+        half_open = self.opened_at is not None
+        if half_open or self.failures >= self.threshold:
+            if not half_open:
+                err(f"{self.failures} transport errors in a row, {hub} seems to be down.")
+            self.opened_at = time.monotonic()
+
+
+def is_transport_error(e: BaseException) -> bool:
+    """Tell errors of the hub or the network from errors of the package."""
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, TimeoutError))
+
+
+def failing_hub(e: BaseException, hubs: Iterable[str]) -> str | None:
+    """
+    The hub whose request failed with `e`.  Errors without a URL, e.g. a
+    dropped connection, can only be told apart if there is just one hub.
+    """
+    if isinstance(e, aiohttp.ClientResponseError) and e.request_info:
+        return which_hub(str(e.request_info.url))
+    if isinstance(e, aiohttp.ClientConnectorError):
+        return which_hub(e.host)
+    hubs = list(hubs)
+    return hubs[0] if len(hubs) == 1 else None
+
+
+def hubs_of(package: PackageEntryV1) -> set[str]:
+    releases: list[ReleaseDescription] = package.get("releases", [])  # type: ignore[assignment]
+    urls = [package.get("details"), *(r.get("base") for r in releases)]
+    return {which_hub(url) for url in urls if url} - {"unknown"}
+
+
+class Budget:
+    """
+    The GitHub GraphQL points we may spend in this run.
+
+    We start with what the API reports as remaining, minus a `reserve`, and
+    learn the real cost per package from the `x-ratelimit-used` headers of
+    the responses as packages finish.  `exhausted` tells when to stop starting
+    new crawls.  Packages not on GitHub cost nothing but still count, so the
+    average is across all packages we crawl, just like the schedule is.
+    """
+    def __init__(
+        self,
+        info: RateLimitInfo,
+        reserve: int = BUDGET_RESERVE,
+        estimated_cost: float = ESTIMATED_COST_PER_PACKAGE
+    ):
+        self.reserve = reserve
+        self.estimated_cost = estimated_cost
+        self.finished = 0
+        self.spent = 0
+        self._window = (info["reset"], info["used"], 0)
+
+    def remaining(self) -> int:
+        return max(0, rate_limit_info["remaining"] - self.reserve)
+
+    def record(self) -> None:
+        """Count one finished package."""
+        self.finished += 1
+        self._sample()
+
+    def _sample(self) -> None:
+        # Points are only comparable within the same rate limit window; when the
+        # window resets we keep what we measured so far and start over from there.
+        reset, used, spent = self._window
+        if rate_limit_info["reset"] != reset:
+            self._window = (rate_limit_info["reset"], rate_limit_info["used"], self.spent)
+        else:
+            self.spent = spent + max(0, rate_limit_info["used"] - used)
+
+    def cost_per_package(self) -> float:
+        if self.finished < MIN_COST_SAMPLES:
+            return self.estimated_cost
+        return max(self.spent / self.finished, 0.1)
+
+    def packages_left(self, in_flight: int = 0) -> int:
+        """The packages we can still afford after the `in_flight` ones are paid."""
+        return max(0, int(self.remaining() / self.cost_per_package()) - in_flight)
+
+    def exhausted(self, in_flight: int = 0) -> bool:
+        return self.packages_left(in_flight) < 1
+
+    def report(self) -> str:
+        return (
+            f"GitHub budget: spent {self.spent} points on {self.finished} packages "
+            f"({self.spent / max(self.finished, 1):.2f} per package), "
+            f"{self.remaining()} left above the reserve of {self.reserve}."
+        )
 
 
 def next_packages_to_crawl(
     registry: Registry, workspace: Workspace, limit: int = 200
 ) -> list[PackageEntryV1]:
     """
-    Returns a list of packages to crawl, sorted by next_crawl timestamp.
-    If next_crawl is not set, it defaults to the current time.
+    Returns a list of packages to crawl, the most overdue first.
+    Packages we have never crawled before come last.
     """
-    now = datetime.now(timezone.utc)
-    now_string = now.strftime("%Y-%m-%d %H:%M:%S")
-    packages = registry["packages"]
-    packages_to_crawl = [
-        entry
-        for entry in packages
-        if not entry.get("tombstoned", False)
-        if (
-            workspace["packages"]
-            .get(entry["name"], {})
-            .get("next_crawl", now_string)
-            <= now_string
-        )
-    ]
+    now = int(time.time())
+    schedule = schedule_of(workspace)
+    candidates: dict[PackageName, PackageEntryV1] = {}
+    never_crawled: list[PackageEntryV1] = []
+    for entry in registry["packages"]:
+        name = entry["name"]
+        if entry.get("tombstoned", False):
+            schedule.discard(name)
+        elif name in schedule:
+            candidates[name] = entry
+        else:
+            never_crawled.append(entry)
+
+    due_count = schedule.count_due(now) + len(never_crawled)
     print(
-        f"Found {len(packages_to_crawl)} packages to crawl.",
-        f"Pick {limit} of them." if limit < len(packages_to_crawl) else ""
+        f"Found {due_count} packages to crawl.",
+        f"Pick {limit} of them." if limit < due_count else ""
     )
-    if len(packages_to_crawl) == 0:
-        if next_package := next(iter(sorted(
-            (
-                entry
-                for entry in packages
-                if not entry.get("tombstoned", False)
-            ),
-            key=lambda pkg: (
-                workspace["packages"]
-                .get(pkg["name"], {})
-                .get("next_crawl", now_string)
-            )
-        )), None):
-            next_crawl_time = (
-                workspace["packages"]
-                .get(next_package["name"], {})
-                .get("next_crawl", now_string)
-            )
-            next_crawl_dt = (
-                datetime
-                .strptime(next_crawl_time, "%Y-%m-%d %H:%M:%S")
-                .replace(tzinfo=timezone.utc)
-            )
-            delta = next_crawl_dt - now
-            minutes = int(delta.total_seconds() // 60)
+    if due_count == 0:
+        if next_due := schedule.peek():
+            seconds = next_due[0] - now
+            minutes = seconds // 60
             if minutes > 0:
                 print(f"Next package runs in {minutes} minutes.")
             else:
-                print(f"Next package runs in {round(delta.total_seconds())} seconds.")
+                print(f"Next package runs in {seconds} seconds.")
+
+    picked = schedule.pop_due(now, limit, accept=candidates.__contains__)
+    tocrawl = [candidates[name] for name in picked] + never_crawled[:limit - len(picked)]
+
+    # Work ahead on packages due soon if this run would be lighter than the
+    # average run over the next WORK_AHEAD.  That fills the gaps between the
+    # spikes of packages becoming due together.
+    target = min(limit, steady_load(schedule, now))
+    if len(tocrawl) < target:
+        ahead = schedule.pop_due(
+            now + WORK_AHEAD, target - len(tocrawl), accept=candidates.__contains__
+        )
+        if ahead:
+            print(f"Work ahead on {len(ahead)} packages due soon.")
+        tocrawl += [candidates[name] for name in ahead]
+    return tocrawl
 
 
-    return sorted(
-        packages_to_crawl,
-        key=lambda pkg: (
-            workspace["packages"]
-            .get(pkg["name"], {})
-            .get("next_crawl", now_string)
-        )
-    )[:limit]
+def steady_load(schedule: Schedule, now: Epoch) -> int:
+    """The number of packages per run if we spread the next WORK_AHEAD evenly."""
+    runs = WORK_AHEAD // RUN_EVERY
+    return -(-schedule.count_due(now + WORK_AHEAD) // runs)
+
+
+def schedule_of(workspace: Workspace) -> Schedule:
+    if "schedule" not in workspace:
+        workspace["schedule"] = Schedule.from_packages(workspace["packages"])
+    return workspace["schedule"]
+
 
 def maintenance(registry: Registry, workspace: Workspace) -> None:
     # lookup all packages in workspace and mark them as `removed`
     # if they have been removed from the registry
-    now = datetime.now(timezone.utc)
-    now_string = now.strftime("%Y-%m-%d %H:%M:%S")
+    now = int(time.time())
     current_package_names = {entry["name"] for entry in registry["packages"]}
     packages = workspace["packages"]
+    schedule = schedule_of(workspace)
     for name in packages.keys() - current_package_names:
-        packages[name].setdefault("removed", now_string)
+        if "removed" not in (entry := packages[name]):
+            packages[name] = {**entry, "removed": now}
+        schedule.discard(name)
 
 
 async def crawl(
     session: aiohttp.ClientSession,
     package: PackageEntryV1,
-    existing: PackageEntry
+    existing: PackageEntry,
+    probe: bool = True,
+    budget: Budget | None = None,
+    interval_bounds: IntervalBounds = (MIN_INTERVAL, MAX_INTERVAL),
+    breakers: MutableMapping[str, CircuitBreaker] | None = None
 ) -> PackageEntry:
     out: PackageEntry
-    now = datetime.now(timezone.utc)
-    now_string = now.strftime("%Y-%m-%d %H:%M:%S")
+    now = int(time.time())
+
+    if budget and budget.exhausted():
+        raise BudgetExhausted(package["name"])
+
+    hub_breakers = {hub: breakers[hub] for hub in hubs_of(package)} if breakers is not None else {}
+    if down := [hub for hub, breaker in hub_breakers.items() if not breaker.allow()]:
+        raise HubDown(", ".join(down))
 
     try:
-        out = await crawl_package(session, package, existing)
+        with deadline(PACKAGE_DEADLINE):
+            max_probe_age = PROBES_PER_FULL_CRAWL * interval_bounds[1]
+            if probe and await is_unchanged(session, package, existing, now, max_probe_age):
+                out = {**existing}
+            else:
+                out = await crawl_package(session, package, existing)
+                out["last_crawled"] = now
+    except RateLimitExhausted as e:
+        # Our quota, not the package's fault: leave it due for the next run
+        raise BudgetExhausted(package["name"]) from e
     except Exception as e:
+        # Don't blame the package for an outage of its hub
+        if (
+            is_transport_error(e)
+            and (hub := failing_hub(e, hub_breakers.keys())) in hub_breakers
+        ):
+            hub_breakers[hub].failure(hub)
+            if hub_breakers[hub].is_open():
+                raise HubDown(hub) from e
+
         out = {**existing}
-        out["failing_since"] = existing.get("failing_since", now_string)
+        out["failing_since"] = existing.get("failing_since", now)
 
         # We mark errors as fatal if we MUST de-list the package immediately.
         # - 404s because all release assets we might have collected will also 404.
@@ -243,59 +675,164 @@ async def crawl(
             out["fail_reason"] = f"Unhandled exception: {type(e).__name__}: {e}\n{tb}"
 
         # Determine next_crawl interval
-        failing_since_dt = (
-            datetime
-            .strptime(out["failing_since"], "%Y-%m-%d %H:%M:%S")
-            .replace(tzinfo=timezone.utc)
-        )
-        age = now - failing_since_dt
-
-        if age <= timedelta(hours=3):
-            interval = timedelta(hours=1)
-        elif age <= timedelta(hours=24):
-            interval = timedelta(hours=3)
-        elif age <= timedelta(days=14):
-            interval = timedelta(hours=6)
+        age = now - out["failing_since"]
+
+        if age <= 3 * HOUR:
+            interval = 1 * HOUR
+        elif age <= 24 * HOUR:
+            interval = 3 * HOUR
+        elif age <= 14 * DAY:
+            interval = 6 * HOUR
         else:
-            interval = timedelta(hours=24)
+            interval = 24 * HOUR
 
-        out["next_crawl"] = (now + interval).strftime("%Y-%m-%d %H:%M:%S")
-        hours_str = str(interval.total_seconds() / 3600).removesuffix(".0")
+        out["next_crawl"] = now + jittered(package["name"], interval)
+        hours_str = str(interval / HOUR).removesuffix(".0")
         s = "s" if hours_str != "1" else ""
         err(f"Retrying in {hours_str} hour{s}.")
         return out
 
-    out["first_seen"] = existing.get("first_seen", now_string)
-    out["last_seen"] = now_string
+    for breaker in hub_breakers.values():
+        breaker.success()
+
+    out["first_seen"] = existing.get("first_seen", now)
+    out["last_seen"] = now
 
     releases = out["releases"]
     if not releases:
         err(f"No releases found for {out['name']}")
         out["invalid"] = True
-        out["next_crawl"] = (now + timedelta(hours=3)).strftime("%Y-%m-%d %H:%M:%S")
+        out["next_crawl"] = now + jittered(package["name"], 3 * HOUR)
     else:
-        out["last_modified"] = max((r["date"] for r in releases))
+        # crawl_package hands back the existing releases if they resolved to
+        # the same commits (ref: has_same_commits); their history stays then.
+        if releases is not existing.get("releases") or "last_modified" not in out:
+            out["last_modified"] = parse_timestamp(max((r["date"] for r in releases)))
+            record_change(out, existing)
+        interval = next_interval(out, now, interval_bounds)
+        out["next_crawl"] = now + jittered(package["name"], interval)
+
+    if "last_changed" in existing and channel_view(out) == channel_view(existing):
+        out["last_changed"] = existing["last_changed"]
+    else:
+        out["last_changed"] = now
+    return out
 
-        # Determine next_crawl interval
-        last_modified_dt = (
-            datetime
-            .strptime(out["last_modified"], "%Y-%m-%d %H:%M:%S")
-            .replace(tzinfo=timezone.utc)
-        )
-        age = now - last_modified_dt
-
-        if age <= timedelta(days=14):
-            interval = timedelta(hours=1)
-        elif age <= timedelta(days=90):
-            interval = timedelta(hours=2)
-        elif age <= timedelta(days=365 * 4):
-            interval = timedelta(hours=3)
-        else:
-            interval = timedelta(hours=24)
 
-        out["next_crawl"] = (now + interval).strftime("%Y-%m-%d %H:%M:%S")
+def has_same_commits(out: PackageEntry, existing: PackageEntry) -> bool:
+    """
+    Tell if every release of the same registry entry resolved to the same
+    commit, under the same version, as last time.  Releases with a fixed
+    url have no commit; they are defined by the registry entry alone.
+    """
+    def commits(entry: PackageEntry) -> list[tuple[str | None, str | None]]:
+        return [(r.get("version"), r.get("sha")) for r in entry.get("releases", [])]
 
-    return out
+    return (
+        "last_modified" in existing
+        and out.get("fingerprint") == existing.get("fingerprint")
+        and commits(out) == commits(existing)
+    )
+
+
+def channel_view(entry: PackageEntry) -> dict:
+    """The parts of `entry` the channel is generated from."""
+    return {k: v for k, v in entry.items() if k not in CRAWL_STATE_FIELDS}
+
+
+def jittered(name: PackageName, interval: int) -> int:
+    """
+    Stretch or shrink `interval` by up to JITTER / 2, always the same for the
+    same package.  Packages crawled in the same run thus don't all become due
+    in the same run again.
+    """
+    digest = hashlib.sha1(name.encode("utf-8")).digest()
+    fraction = int.from_bytes(digest[:4]) / 2**32
+    return interval + int((fraction - 0.5) * JITTER * interval)
+
+
+def record_change(out: PackageEntry, existing: PackageEntry) -> None:
+    """
+    Remember when the releases of a package changed, and keep an EWMA of the
+    time between two changes.  We take the date of the newest release as the
+    time of the change, so a package doesn't look busier because we're slow.
+    """
+    history = list(existing.get("changes", []))
+    if not history and (last_modified := existing.get("last_modified")):
+        history = [last_modified]  # entries from before we kept a history
+    change_interval = existing.get("change_interval")
+
+    changed_at = out["last_modified"]
+    if not history or changed_at > history[-1]:
+        if history:
+            gap = changed_at - history[-1]
+            change_interval = (
+                gap
+                if change_interval is None
+                else round(CHANGE_EWMA_ALPHA * gap + (1 - CHANGE_EWMA_ALPHA) * change_interval)
+            )
+        history.append(changed_at)
+
+    out["changes"] = history[-CHANGE_HISTORY:]
+    if change_interval is not None:
+        out["change_interval"] = change_interval
+
+
+def next_interval(
+    entry: PackageEntry,
+    now: Epoch,
+    bounds: IntervalBounds = (MIN_INTERVAL, MAX_INTERVAL)
+) -> int:
+    """
+    Seconds until we should crawl `entry` again.  We expect the next change
+    after the typical time between changes, or, if the package has been quiet
+    for longer than that, after as long as it has been quiet already.  Archived
+    repositories are only rarely looked at.
+    """
+    min_interval, max_interval = bounds
+    if entry.get("archived_at"):
+        return max(ARCHIVED_INTERVAL, max_interval)
+    expected = max(entry.get("change_interval", 0), now - entry["last_modified"])
+    return min(max(int(expected * CHANGE_FRACTION), min_interval), max_interval)
+
+
+async def is_unchanged(
+    session: aiohttp.ClientSession,
+    package: PackageEntryV1,
+    existing: PackageEntry,
+    now: Epoch,
+    max_probe_age: int = PROBES_PER_FULL_CRAWL * MAX_INTERVAL
+) -> bool:
+    """
+    Phase one of a crawl: ask the hubs only for the current heads of the
+    repositories the package was built from, and compare them with what we
+    saw last time.  Packages that failed, were removed from the registry,
+    changed in it, or have not been fully crawled for `max_probe_age` seconds
+    are never "unchanged".
+    """
+    if (
+        "heads" not in existing
+        or not existing.get("releases")
+        or existing.get("failing_since")
+        or existing.get("removed")
+        or existing.get("invalid")
+        or existing.get("fingerprint") != fingerprint(package)
+    ):
+        return False
+    if now - existing.get("last_crawled", 0) > max_probe_age:
+        return False
+
+    heads = await asyncio.gather(*(
+        fetch_github_heads(session, url, branches_of_heads(signature))
+        for url, signature in existing["heads"].items()
+    ))
+    return dict(zip(existing["heads"], heads)) == existing["heads"]
+
+
+def fingerprint(package: PackageEntryV1) -> str:
+    return hashlib.sha1(
+        json.dumps(package, sort_keys=True).encode("utf-8")
+    ).hexdigest()
 
 
 async def crawl_package(
@@ -303,7 +840,7 @@ async def crawl_package(
     entry: PackageEntryV1,
     existing: PackageEntry
 ) -> PackageEntry:
-    out: PackageEntry = {**entry}
+    out: PackageEntry = {**entry, "fingerprint": fingerprint(entry)}
     if "readme" in out:
         out["readme"] = update_url(resolve_url(out["source"], out["readme"]))
     details = out.get("details")
@@ -313,6 +850,8 @@ async def crawl_package(
     normalize_release_definition(release_definitions, out["source"], details)
 
     uow: defaultdict[Url, set[QueryScope]] = defaultdict(set)
+    wanted_branches: defaultdict[Url, set[str]] = defaultdict(set)
+    tag_prefixes: defaultdict[Url, set[str]] = defaultdict(set)
     if details:
         uow[details].add("METADATA")
 
@@ -321,22 +860,43 @@ async def crawl_package(
             continue
         if base := r.get("base"):
             uow[base].add("METADATA")
-            if "tags" in r:
+            if (tag_definition := r.get("tags")) is True:
                 uow[base].add("TAGS")
-            if "branch" in r:
-                uow[base].add("BRANCHES")
-
-    for url, scopes in uow.items():
-        match which_hub(url):
-            case "github":
-                info = await fetch_github_info(session, url, scopes)
-            case "bitbucket":
-                info = await fetch_bitbucket_info(session, url, scopes)
-            case "gitlab":
-                info = await fetch_gitlab_info(session, url, scopes)
-            case _:
-                err(f"Backend for {url} not implemented yet")
-                continue
+            elif tag_definition:
+                tag_prefixes[base].add(tag_definition)
+            # The default branch comes with the METADATA for free
+            if isinstance(branch_name := r.get("branch"), str):
+                wanted_branches[base].add(branch_name)
+
+    # Only if we know the heads of all repositories involved, the next crawl
+    # can be a cheap probe (ref: is_unchanged)
+    heads: dict[Url, str] | None = {}
+    # Fetch all repositories at once, then fulfill the releases in order.  The
+    # `details` repository comes first, so a HeartAttack stops us before we
+    # take anything from the other repositories.
+    infos = await asyncio.gather(*(
+        fetch_info(
+            session, url, scopes, wanted_branches[url], tag_prefixes[url],
+            readme_hint=existing.get("readmes", {}).get(url),
+            tag_depths=existing.get("tag_depths", {}).get(url)
+        )
+        for url, scopes in uow.items()
+    ))
+    readmes: dict[Url, ReadmeHint] = {}
+    tag_depths: defaultdict[Url, dict[str, int]] = defaultdict(dict)
+    for url, info in zip(uow, infos):
+        if info is None:
+            err(f"Backend for {url} not implemented yet")
+            heads = None
+            continue
+
+        if heads is not None:
+            if head := info.get("heads"):
+                heads[url] = head
+            else:
+                heads = None
+        if readme_key := info.get("readme_key"):
+            readmes[url] = (readme_key, info["metadata"].get("readme"))
 
         if url == details:
             out = info["metadata"] | out
@@ -358,7 +918,10 @@ async def crawl_package(
 
             if tag_defintion := r.get("tags"):
                 tag_prefix = "" if tag_defintion is True else tag_defintion
-                async for tag in info["tags"]:
+                tags = info["tags_with_prefix"](tag_prefix) if tag_prefix else info["tags"]
+                depth = 0
+                async for tag in tags:
+                    depth += 1
                     if (
                         tag["name"].startswith(tag_prefix)
                         and (version := (
@@ -369,8 +932,9 @@ async def crawl_package(
                         and is_semver(version)
                     ):
                         r.pop("tags")
-                        r |= pluck(tag, ("url", "date"))  # type: ignore[arg-type]
+                        r |= pluck(tag, ("url", "date", "sha"))  # type: ignore[arg-type]
                         r |= {"version": version}
+                        tag_depths[url][tag_prefix] = depth
                         break
                 if "version" in r:
                     continue
@@ -388,12 +952,9 @@ async def crawl_package(
                 if branches_defintion is True
                 else branches_defintion
             )
-            async for branch in info["branches"]:
-                if branch["name"] == wanted_branch:
-                    r.pop("branch", None)
-                    r |= pluck(branch, ("version", "url", "date"))  # type: ignore[arg-type]
-                    break
-            if "version" in r:
+            if branch := await info["branch"](wanted_branch):
+                r.pop("branch", None)
+                r |= pluck(branch, ("version", "url", "date", "sha"))  # type: ignore[arg-type]
                 continue
 
             err(
@@ -402,18 +963,90 @@ async def crawl_package(
             )
             release_definitions.remove(r)
 
-    for r in release_definitions[:]:
-        if missing_keys := missing_from_release_definition(r):
-            s = "s" if len(missing_keys) > 1 else ""
-            err(
-                f"Release definition {r} for {entry['name']} incomplete.  "
-                f"Missing key{s}: {missing_keys}"
-            )
-            release_definitions.remove(r)
-
+    if has_same_commits(out, existing):
+        # Every release is what we took last time: keep them, and what we
+        # derived from them, as they were instead of checking them again.
+        out["releases"] = existing["releases"]
+        for key in ("last_modified", "changes", "change_interval"):
+            if key in existing:
+                out[key] = existing[key]
+    else:
+        for r in release_definitions[:]:
+            if missing_keys := missing_from_release_definition(r):
+                s = "s" if len(missing_keys) > 1 else ""
+                err(
+                    f"Release definition {r} for {entry['name']} incomplete.  "
+                    f"Missing key{s}: {missing_keys}"
+                )
+                release_definitions.remove(r)
+
+    if heads is not None:
+        out["heads"] = heads
+    if readmes:
+        out["readmes"] = readmes
+    if tag_depths:
+        out["tag_depths"] = dict(tag_depths)
     return out
 
 
+type InfoKey = tuple[Url, frozenset[QueryScope], frozenset[str], frozenset[str]]
+_repo_infos: WeakKeyDictionary[
+    aiohttp.ClientSession, dict[InfoKey, asyncio.Task[RepoInfo]]
+] = WeakKeyDictionary()
+
+
+async def fetch_info(
+    session: aiohttp.ClientSession,
+    url: Url,
+    scopes: Iterable[QueryScope],
+    branches: Iterable[str] = (),
+    tag_prefixes: Iterable[str] = (),
+    readme_hint: ReadmeHint | None = None,
+    tag_depths: Mapping[str, int] | None = None
+) -> RepoInfo | None:
+    """
+    Fetch the info of the repository at `url` from its hub, or return None if
+    we don't know the hub.  Within a run, i.e. for the same `session`, callers
+    asking for the same thing share one request and one RepoInfo, including
+    the pages its pagers fetch.  Failed requests are not cached, and of the
+    finished ones only the `SHARED_INFOS` most recently asked for.  The
+    `readme_hint` and `tag_depths` only save work, so they are not part of
+    what we ask for.
+    """
+    match which_hub(url):
+        case "github":
+            fetch = partial(fetch_github_info, tag_depths=tag_depths)
+        case "bitbucket":
+            fetch = fetch_bitbucket_info  # type: ignore[assignment]
+        case "gitlab":
+            fetch = fetch_gitlab_info  # type: ignore[assignment]
+        case _:
+            return None
+
+    scopes, branches, tag_prefixes = frozenset(scopes), frozenset(branches), frozenset(tag_prefixes)
+    key = (url, scopes, branches, tag_prefixes)
+    infos = _repo_infos.setdefault(session, {})
+    if (task := infos.pop(key, None)) is None:
+        task = asyncio.create_task(
+            fetch(session, url, scopes, branches, tag_prefixes, readme_hint)
+        )
+
+        def forget_failed(task: asyncio.Task[RepoInfo]) -> None:
+            if (task.cancelled() or task.exception()) and infos.get(key) is task:
+                del infos[key]
+        task.add_done_callback(forget_failed)
+    infos[key] = task  # the most recently asked for come last
+
+    # Forget the oldest finished ones.  Packages still working with them
+    # keep them alive, but nobody else will find them anymore.
+    finished = [k for k, t in infos.items() if t.done()]
+    for k in finished[:max(0, len(infos) - SHARED_INFOS)]:
+        del infos[k]
+
+    # Our cancellation must not cancel the request other callers wait for
+    return await asyncio.shield(task)
+
+
 def pluck[K, V](d: dict[K, V], keys: Iterable[K]) -> dict[K, V]:
     return {
         k: v
@@ -548,7 +1181,9 @@ def parse_args():
         "--workspace",
         type=str,
         default=DEFAULT_WORKSPACE,
-        help=f"Path to the workspace JSON file (default: {DEFAULT_WORKSPACE})")
+        help=(
+            f"Path to the workspace JSON file, or an SQLite database "
+            f"if it ends with .sqlite or .db (default: {DEFAULT_WORKSPACE})"))
     parser.add_argument(
         "--name",
         type=str,
@@ -561,6 +1196,28 @@ def parse_args():
         type=int,
         default=200,
         help="Maximum number of packages to crawl (default: 200)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help=f"Number of packages to crawl concurrently (default: {WORKERS})")
+    parser.add_argument(
+        "--time-limit",
+        type=float,
+        default=None,
+        help="Don't start crawling more packages after this many minutes (default: no limit)")
+    parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=MIN_INTERVAL / HOUR,
+        help=f"Minimum hours between two crawls of a package (default: {MIN_INTERVAL // HOUR})")
+    parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=MAX_INTERVAL / HOUR,
+        help=(
+            f"Maximum hours between two crawls of a package, except for archived "
+            f"repositories (default: {MAX_INTERVAL // HOUR})"))
     parser.add_argument(
         "--wd",
         type=str,
@@ -576,4 +1233,12 @@ if __name__ == "__main__":
     os.makedirs(wd, exist_ok=True)
     args.registry = os.path.normpath(os.path.join(wd, args.registry))
     args.workspace = os.path.normpath(os.path.join(wd, args.workspace))
-    asyncio.run(main(args.registry, args.workspace, args.name, args.limit))
+    try:
+        asyncio.run(main(
+            args.registry, args.workspace, args.name, args.limit,
+            (int(args.min_interval * HOUR), int(args.max_interval * HOUR)),
+            args.workers,
+            args.time_limit * 60 if args.time_limit else None
+        ))
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        sys.exit(130)
@@ -6,6 +6,8 @@ import sys
 import os
 from typing import TypedDict, Literal
 
+from .utils import format_timestamp
+from .workspace import open_workspace
 
 type RepositoryUrl = str
 type Platform = Literal["*", "windows", "osx", "linux"]
@@ -63,9 +65,13 @@ def main(registry_path, workspace_path, channel_path):
         sys.exit(1)
 
     # Load workspace
+    if not os.path.exists(workspace_path):
+        err(f"FATAL: Workspace file '{workspace_path}' does not exist.")
+        sys.exit(1)
     try:
-        with open(workspace_path, "r", encoding="utf-8") as f:
-            workspace = json.load(f)
+        with open_workspace(workspace_path) as store:
+            workspace = store.load()
+            workspace["packages"] = dict(workspace["packages"].items())
     except Exception as e:
         err(f"FATAL: Could not read workspace file '{workspace_path}': {e}")
         sys.exit(1)
@@ -182,7 +188,7 @@ def normalize_package(pkg) -> Package | None:
     out: Package = {
         "name": pkg["name"],
         "author": author,
-        "last_modified": pkg["last_modified"],
+        "last_modified": format_timestamp(pkg["last_modified"]),
         "releases": releases,
 
         # mandatory with fallback
@@ -204,7 +210,7 @@ def failing_since(pkg):
     extra = ""
     if failing_since := pkg.get("failing_since"):
         try:
-            dt = datetime.strptime(failing_since, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+            dt = datetime.fromtimestamp(failing_since, timezone.utc)
             rel = relative_time(dt)
             extra = f"since {rel}"
         except Exception:
@@ -248,7 +254,9 @@ def parse_args():
         "--workspace",
         type=str,
         default=DEFAULT_WORKSPACE,
-        help=f"Path to the workspace JSON file (default: {DEFAULT_WORKSPACE})")
+        help=(
+            f"Path to the workspace JSON file, or an SQLite database "
+            f"if it ends with .sqlite or .db (default: {DEFAULT_WORKSPACE})"))
     parser.add_argument(
         "--output",
         "-o",
@@ -7,28 +7,41 @@ import asyncio
 import re
 from time import time
 from urllib.parse import urlparse
+from weakref import WeakKeyDictionary
 
-from typing import AsyncIterable, Literal, Iterable, TypedDict
+from typing import AsyncIterable, Awaitable, Callable, Literal, Iterable, Mapping, TypedDict
 
-from .utils import is_semver, drop_falsy
+from .governor import governor_for
+from .retry import with_retry
+from .utils import is_semver, drop_falsy, err, parse_timestamp
 
 # This module exposes a single entrypoint
 # fetch_repo_info(Url, Iterable[QueryScope]) -> RepoInfo
 # fetch_repo_info("https://github.com/timbrel/GitSavvy", ("METADATA", "TAGS"))
 # "tags" and "branches" are lazy fetched, unless you provide TAGS or BRANCHES as
 # initial QueryScope, until exhausted. (Ref: TagPager and BranchesPager)
+# Single branches are better looked up by name using "branch", which costs at
+# most one query, and nothing at all for the default branch or for names passed
+# in as `branches` upfront.  (Ref: BranchLookup)
+# Likewise, "tags_with_prefix" filters the tags on the server.  Prefixes passed
+# in as `tag_prefixes` are fetched with the initial query.  (Ref: PrefixedTags)
 
 type QueryScope = Literal["METADATA", "TAGS", "BRANCHES"]
 type Query = str | tuple[str, str]
 type Url = str
 type Sha = str
 type IsoTimestamp = str
+type ReadmeHint = tuple[str | None, Url | None]  # the key it's valid for, the README url
 
 
 class RepoInfo(TypedDict):
     metadata: RepoMetadata
     tags: AsyncIterable[TagInfo]
     branches: AsyncIterable[BranchInfo]
+    branch: Callable[[str], Awaitable[BranchInfo | None]]
+    tags_with_prefix: Callable[[str], AsyncIterable[TagInfo]]
+    heads: str | None
+    readme_key: str | None  # the default branch head, ref. ReadmeHint
     rate_limit_info: RateLimitInfo
 
 
@@ -80,11 +93,12 @@ rate_limit_info: RateLimitInfo = {
     "resource": "core",
 }
 GITHUB_API_URL = "https://api.github.com/graphql"
+RATE_LIMIT = "query { rateLimit { limit remaining used cost resetAt } }"
+BATCH_WINDOW = 0.05   # seconds to wait for more queries to join a batch
+MAX_BATCH_SIZE = 20   # repositories per aliased query
 
 STD_VARS = "$owner: String!, $name: String!"
-METADATA = (
-    '$branch_ex: String="HEAD:"',
-    """
+METADATA = """
     id
     name
     description
@@ -94,6 +108,12 @@ METADATA = (
     }
     defaultBranchRef {
       name
+      target {
+        ... on Commit {
+          oid
+          committedDate
+        }
+      }
     }
     fundingLinks {
       url
@@ -102,7 +122,23 @@ METADATA = (
     stargazerCount
     createdAt
     archivedAt
-
+    """
+# Finding the README: we remember where it was per repository and default
+# branch head (ref: `ReadmeHint`).  If the head moved, we keep it for one more
+# crawl.  If we don't know it, we probe for the usual names along with the
+# metadata, and only then list the root directory.
+README_CANDIDATES = (
+    "README.md", "readme.md", "Readme.md", "README.rst", "README.txt", "README",
+    "README.markdown", "readme.txt", "README.mdown", "README.mkd", "README.textile",
+    "README.creole",
+)
+README_PROBES = "\n".join(
+    f'readme_{i}: object(expression: "HEAD:{name}") {{ ... on Blob {{ oid }} }}'
+    for i, name in enumerate(README_CANDIDATES)
+)
+ROOT_TREE = (
+    '$branch_ex: String="HEAD:"',
+    """
     files: object(expression: $branch_ex) {
       ... on Tree {
         entries {
@@ -137,39 +173,111 @@ BRANCHES = (
     }
     """
 )
-TAGS = (
-    '$tags_after: String',
+
+
+TAGS_PAGE_SIZE = 100
+MIN_TAGS_PAGE_SIZE = 5
+
+
+def tags_query(alias: str = "tags") -> Query:
     """
-    tags: refs(
+    Query a page of tags, newest first.  `${alias}_query` optionally filters
+    the tags by name on the server, e.g. "st4-".  `${alias}_first` sizes the
+    page, ref. `tags_page_size`.
+    """
+    return (
+        f'${alias}_after: String, ${alias}_query: String, ${alias}_first: Int = {TAGS_PAGE_SIZE}',
+        f"""
+    {alias}: refs(
       refPrefix: "refs/tags/"
-      first: 100
-      after: $tags_after
-      orderBy: {field: TAG_COMMIT_DATE, direction: DESC}
-    ) {
-      pageInfo {
+      query: ${alias}_query
+      first: ${alias}_first
+      after: ${alias}_after
+      orderBy: {{field: TAG_COMMIT_DATE, direction: DESC}}
+    ) {{
+      pageInfo {{
         hasNextPage
         endCursor
-      }
-      nodes {
+      }}
+      nodes {{
         name
-        target {
-          ... on Tag {
-            target {
-              ... on Commit {
+        target {{
+          ... on Tag {{
+            target {{
+              ... on Commit {{
                 oid
                 committedDate
-              }
-            }
-          }
-          ... on Commit {
+              }}
+            }}
+          }}
+          ... on Commit {{
             oid
             committedDate
-          }
+          }}
+        }}
+      }}
+    }}
+    """
+    )
+
+
+TAGS = tags_query()
+
+
+def tags_page_size(depth: int | None) -> int:
+    """
+    The size of the first page of tags if the tag we were looking for was
+    the `depth`th one last time.  We leave room for some new tags which don't
+    match, e.g. pre-releases.  If that's not enough, the pager fetches full
+    pages as usual.
+    """
+    if depth is None:
+        return TAGS_PAGE_SIZE
+    return min(TAGS_PAGE_SIZE, max(MIN_TAGS_PAGE_SIZE, 2 * depth))
+
+
+# The cheap "did anything change?" probe: the head of the default branch
+# and the newest tag, plus the named branches releases are taken from.
+# (Ref: grab_heads)
+HEADS = """
+    head: defaultBranchRef {
+      target {
+        oid
+      }
+    }
+    latest_tag: refs(
+      refPrefix: "refs/tags/"
+      first: 1
+      orderBy: {field: TAG_COMMIT_DATE, direction: DESC}
+    ) {
+      nodes {
+        name
+        target {
+          oid
         }
       }
     }
     """
-)
+
+
+def branch_query(i: int) -> Query:
+    """Look up a single branch by name, `$branch_{i}` is its qualified name."""
+    return (
+        f'$branch_{i}: String!',
+        f"""
+    branch_{i}: ref(qualifiedName: $branch_{i}) {{
+      name
+      target {{
+        ... on Commit {{
+          oid
+          committedDate
+        }}
+      }}
+    }}
+    """
+    )
+
+
 scope_to_query: dict[str, Query] = {
     "METADATA": METADATA,
     "TAGS": TAGS,
@@ -177,22 +285,44 @@ scope_to_query: dict[str, Query] = {
 }
 
 
-def build_query(sub_queries: Iterable[str | tuple[str, str]]) -> str:
-    queries, vars = [], []
-    for q in sub_queries:
-        if isinstance(q, tuple):
-            vars.append(q[0])
-            queries.append(q[1])
-        else:
-            queries.append(q)
-
-    return f"""
-    query GetRepoMetadata({", ".join(drop_falsy([STD_VARS] + vars))}) {{
-      repository(owner: $owner, name: $name) {{
+def build_batch_query(
+    requests: Iterable[tuple[Iterable[Query], dict]]
+) -> tuple[str, dict]:
+    """
+    Combine per-repository queries into one query with aliased `repository`
+    fields (`r0`, `r1`, ...).  Variables are suffixed with the alias index so
+    that every repository keeps its own set, e.g. `$owner` becomes `$owner_0`.
+    """
+    fields, decls, variables = [], [], {}
+    for i, (sub_queries, vars_) in enumerate(requests):
+        def rename(text: str) -> str:
+            return re.sub(r'\$(\w+)', rf'$\1_{i}', text)
+
+        queries = []
+        for q in sub_queries:
+            if isinstance(q, tuple):
+                decls.append(rename(q[0]))
+                queries.append(rename(q[1]))
+            else:
+                queries.append(rename(q))
+        decls.append(rename(STD_VARS))
+        declared = set(re.findall(r'\$(\w+):', STD_VARS + " ".join(
+            q[0] for q in sub_queries if isinstance(q, tuple)
+        )))
+        variables.update({
+            f"{k}_{i}": v for k, v in vars_.items() if k in declared
+        })
+        fields.append(f"""
+      r{i}: repository(owner: $owner_{i}, name: $name_{i}) {{
         {"\n".join(queries)}
-      }}
+      }}""")
+
+    query = f"""
+    query GetRepositories({", ".join(decls)}) {{
+      {"".join(fields)}
     }}
     """
+    return query, variables
 
 
 _readme_filenames = {
@@ -205,62 +335,276 @@ class GraphQLClientError(aiohttp.ClientResponseError):
     """Structured exception for GraphQL API errors with type/message."""
 
 
-async def make_graphql_query(session: aiohttp.ClientSession, query: str, variables: dict) -> dict:
-    global rate_limit_info
-
-    token = os.getenv("GITHUB_TOKEN")
-    if not token:
-        raise RuntimeError("GITHUB_TOKEN env var is not set")
-
+async def post_graphql(
+    session: aiohttp.ClientSession,
+    query: str,
+    variables: dict,
+    token: GitHubToken | None = None
+) -> tuple[dict, aiohttp.ClientResponse]:
+    pool = token_pool()
+    token = token or pool.pick()
     headers = {
-        "Authorization": f"Bearer {token}",
+        "Authorization": f"Bearer {token.value}",
         "Accept": "application/json",
     }
 
-    async with session.post(
-        GITHUB_API_URL,
-        json={"query": query, "variables": variables},
-        headers=headers,
-        raise_for_status=True
-    ) as resp:
-        data = await resp.json()
-        if "errors" in data:
-            first_error = data["errors"][0]
-            message = first_error.get("message", "Unknown GraphQL error")
-            error_type = first_error.get("type", "").upper()
-
-            status_map = {
-                "NOT_FOUND": 404,
-                "FORBIDDEN": 403,
-                "UNAUTHORIZED": 401,
-                "RATE_LIMITED": 429,
-                "INTERNAL": 502,
-                "SERVICE_UNAVAILABLE": 503,
-            }
-            status = status_map.get(error_type, 400)
-
-            raise GraphQLClientError(
-                request_info=resp.request_info,
-                history=resp.history,
-                status=status,
-                message=message,
-                headers=resp.headers
-            )
+    try:
+        async with governor_for(session, GITHUB_API_URL).slot():
+            async with session.post(
+                GITHUB_API_URL,
+                json={"query": query, "variables": variables},
+                headers=headers,
+                raise_for_status=True
+            ) as resp:
+                if "x-ratelimit-remaining" in resp.headers:
+                    token.update(grab_rate_limit_info(resp.headers))
+                return await resp.json(), resp
+    except aiohttp.ClientResponseError as e:
+        if e.status == 401:
+            token.revoke()
+        elif e.headers and "x-ratelimit-remaining" in e.headers:
+            token.update(grab_rate_limit_info(e.headers))
+        raise
+    finally:
+        rate_limit_info.update(pool.summary())
+
+
+def graphql_error(error: dict, resp: aiohttp.ClientResponse) -> GraphQLClientError:
+    message = error.get("message", "Unknown GraphQL error")
+    error_type = error.get("type", "").upper()
+
+    status_map = {
+        "NOT_FOUND": 404,
+        "FORBIDDEN": 403,
+        "UNAUTHORIZED": 401,
+        "RATE_LIMITED": 429,
+        "INTERNAL": 502,
+        "SERVICE_UNAVAILABLE": 503,
+    }
+    status = status_map.get(error_type, 400)
 
-        reset_time = int(resp.headers.get("x-ratelimit-reset", 0))
-        rv = data["data"]
-        rv["rate_limit_info"] = {
-            "limit": int(resp.headers.get("x-ratelimit-limit", 0)),
-            "remaining": int(resp.headers.get("x-ratelimit-remaining", 0)),
-            "used": int(resp.headers.get("x-ratelimit-used", 0)),
-            "reset": reset_time,
-            "resource": resp.headers.get("x-ratelimit-resource", "core"),
-            "reset_formatted": datetime.fromtimestamp(reset_time).strftime("%Y-%m-%d %H:%M:%S")
+    return GraphQLClientError(
+        request_info=resp.request_info,
+        history=resp.history,
+        status=status,
+        message=message,
+        headers=resp.headers
+    )
+
+
+def grab_rate_limit_info(headers: Mapping[str, str]) -> RateLimitInfo:
+    reset_time = int(headers.get("x-ratelimit-reset", 0))
+    return {
+        "limit": int(headers.get("x-ratelimit-limit", 0)),
+        "remaining": int(headers.get("x-ratelimit-remaining", 0)),
+        "used": int(headers.get("x-ratelimit-used", 0)),
+        "reset": reset_time,
+        "resource": headers.get("x-ratelimit-resource", "core"),
+        "reset_formatted": datetime.fromtimestamp(reset_time).strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+async def fetch_rate_limit(session: aiohttp.ClientSession) -> RateLimitInfo:
+    """
+    Ask for the current GraphQL rate limit of all our tokens, and return the
+    sum of them.  The `rateLimit` query itself does not count against the limit.
+    """
+    pool = token_pool()
+    for token in pool.tokens:
+        payload, _ = await post_graphql(session, RATE_LIMIT, {}, token=token)
+        if data := (payload.get("data") or {}).get("rateLimit"):
+            # The body is authoritative, the headers are only sent along
+            reset_time = parse_timestamp(data["resetAt"])
+            token.update({
+                "limit": data["limit"],
+                "remaining": data["remaining"],
+                "used": data["used"],
+                "reset": reset_time,
+                "resource": "graphql",
+                "reset_formatted": datetime.fromtimestamp(reset_time).strftime("%Y-%m-%d %H:%M:%S")
+            })
+    rate_limit_info.update(pool.summary())
+    return pool.summary()
+
+
+class GitHubToken:
+    """A token and its rate limit as last reported by GitHub."""
+    def __init__(self, value: str):
+        self.value = value
+        self.info: RateLimitInfo | None = None  # unknown until we used it
+
+    def update(self, info: RateLimitInfo) -> None:
+        # Responses arrive out of order, only take newer numbers.  A different
+        # reset time means a new rate limit window; `used` starts over then.
+        if (
+            self.info is None
+            or info["reset"] != self.info["reset"]
+            or info["used"] > self.info["used"]
+        ):
+            self.info = info
+
+    def revoke(self) -> None:
+        err("A GitHub token was rejected (401), not using it anymore.")
+        self.info = {
+            "limit": 0, "remaining": 0, "used": 0, "reset": 2**31,
+            "resource": "graphql", "reset_formatted": "never"
+        }
+
+    def remaining(self, now: float) -> float:
+        """The points left, or infinity if we don't know yet or it has been reset."""
+        if self.info is None or now >= self.info["reset"]:
+            return float("inf")
+        return self.info["remaining"]
+
+
+class TokenPool:
+    """
+    All the GitHub tokens we may use.  Every request goes out with the token
+    with the most points left; used up tokens are parked until their reset.
+    """
+    def __init__(self, tokens: Iterable[str]):
+        self.tokens = [GitHubToken(value) for value in dict.fromkeys(tokens) if value]
+
+    @classmethod
+    def from_env(cls) -> TokenPool:
+        tokens = [os.getenv("GITHUB_TOKEN", "")]
+        tokens += os.getenv("GITHUB_TOKENS", "").split(",")
+        if path := os.getenv("GITHUB_TOKENS_FILE"):
+            with open(path, encoding="utf-8") as f:
+                tokens += [line for line in f if not line.startswith("#")]
+        return cls(token.strip() for token in tokens)
+
+    def pick(self) -> GitHubToken:
+        if not self.tokens:
+            raise RuntimeError(
+                "No GitHub token: set GITHUB_TOKEN, GITHUB_TOKENS (comma-separated), "
+                "or GITHUB_TOKENS_FILE (one token per line)"
+            )
+        now = time()
+        token = max(self.tokens, key=lambda token: token.remaining(now))
+        if token.remaining(now) <= 0:
+            reset = min(token.info["reset"] for token in self.tokens if token.info)
+            raise RateLimitExhausted(
+                f"All {len(self.tokens)} GitHub tokens are used up until "
+                f"{datetime.fromtimestamp(reset).strftime('%Y-%m-%d %H:%M:%S')}"
+            )
+        return token
+
+    def summary(self) -> RateLimitInfo:
+        """The rate limits of all tokens we have used, as if it were one token."""
+        now = time()
+        known = [token.info for token in self.tokens if token.info]
+        if not known:
+            return rate_limit_info
+        reset = min(info["reset"] for info in known)
+        return {
+            "limit": sum(info["limit"] for info in known),
+            "remaining": sum(
+                info["limit"] if now >= info["reset"] else info["remaining"] for info in known
+            ),
+            "used": sum(info["used"] for info in known),
+            "reset": reset,
+            "resource": known[0]["resource"],
+            "reset_formatted": datetime.fromtimestamp(reset).strftime("%Y-%m-%d %H:%M:%S")
         }
-        # Update global rate limit info only if newer to count for unordered responses
-        if rv["rate_limit_info"]["used"] > rate_limit_info["used"]:
-            rate_limit_info.update(rv["rate_limit_info"])
-        return rv
+
+    def report(self) -> list[str]:
+        return [
+            f"GitHub token {i}: {info['remaining']}/{info['limit']} left, "
+            f"resets at {info['reset_formatted']}"
+            if (info := token.info) else f"GitHub token {i}: not used"
+            for i, token in enumerate(self.tokens, 1)
+        ]
+
+
+class RateLimitExhausted(RuntimeError):
+    """Raised when all GitHub tokens are used up."""
+
+
+_token_pool: TokenPool | None = None
+
+
+def token_pool() -> TokenPool:
+    global _token_pool
+    if _token_pool is None:
+        _token_pool = TokenPool.from_env()
+    return _token_pool
+
+
+class QueryBatcher:
+    """
+    Collect the repository queries issued by concurrent tasks for a short
+    window (`BATCH_WINDOW`) and send them as one aliased GraphQL query.
+    Every caller gets back `{"repository": ..., "rate_limit_info": ...}`.
+    """
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+        self._pending: list[tuple[list[Query], dict, asyncio.Future[dict]]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._inflight: set[asyncio.Task] = set()
+
+    async def query(self, sub_queries: Iterable[Query], variables: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future[dict] = loop.create_future()
+        self._pending.append((list(sub_queries), variables, fut))
+        if len(self._pending) >= MAX_BATCH_SIZE:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(BATCH_WINDOW, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: list[tuple[list[Query], dict, asyncio.Future[dict]]]) -> None:
+        query, variables = build_batch_query((q, v) for q, v, _ in batch)
+        try:
+            data, resp = await post_graphql(self._session, query, variables)
+        except Exception as e:
+            for *_, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        errors_by_alias: dict[str | None, dict] = {}
+        for error in data.get("errors", []):
+            path = error.get("path") or [None]
+            errors_by_alias.setdefault(path[0], error)
+        info = grab_rate_limit_info(resp.headers)
+
+        for i, (*_, fut) in enumerate(batch):
+            if fut.done():
+                continue
+            alias = f"r{i}"
+            error = errors_by_alias.get(alias) or errors_by_alias.get(None)
+            if error or not (data.get("data") or {}).get(alias):
+                fut.set_exception(graphql_error(error or {}, resp))
+            else:
+                fut.set_result({"repository": data["data"][alias], "rate_limit_info": info})
+
+
+_batchers: WeakKeyDictionary[aiohttp.ClientSession, QueryBatcher] = WeakKeyDictionary()
+
+
+async def query_repository(
+    session: aiohttp.ClientSession, sub_queries: Iterable[Query], variables: dict
+) -> dict:
+    """Run a repository query, batched with the queries of concurrent callers."""
+    try:
+        batcher = _batchers[session]
+    except KeyError:
+        batcher = _batchers[session] = QueryBatcher(session)
+    # Retry only our part, a retry joins the next batch.
+    sub_queries = list(sub_queries)
+    return await with_retry(lambda: batcher.query(sub_queries, variables))
 
 
 def parse_owner_repo(url: str):
@@ -278,19 +622,71 @@ def parse_owner_repo(url: str):
 async def fetch_github_info(
     session: aiohttp.ClientSession,
     github_url: str,
-    scopes: Iterable[QueryScope]
+    scopes: Iterable[QueryScope],
+    branches: Iterable[str] = (),
+    tag_prefixes: Iterable[str] = (),
+    readme_hint: ReadmeHint | None = None,
+    tag_depths: Mapping[str, int] | None = None
 ) -> RepoInfo:
+    """
+    `tag_depths` tells, per tag prefix ("" for all tags), how deep into the
+    tags the version was last time, so that the first page of tags can be
+    smaller.
+    """
     owner, repo = parse_owner_repo(github_url)
+    branches = list(branches)
+    tag_prefixes = list(tag_prefixes)
+    tag_depths = tag_depths or {}
+    with_metadata = "METADATA" in scopes
     variables = {
         "owner": owner,
         "name": repo,
-        "expression": "HEAD:"
+        "expression": "HEAD:",
+        **{f"branch_{i}": f"refs/heads/{name}" for i, name in enumerate(branches)},
+        **{f"tags_{i}_query": prefix for i, prefix in enumerate(tag_prefixes)},
+        **{
+            f"tags_{i}_first": tags_page_size(tag_depths[prefix])
+            for i, prefix in enumerate(tag_prefixes)
+            if prefix in tag_depths
+        },
     }
-    query = build_query(scope_to_query[scope] for scope in scopes)
-    data = await make_graphql_query(session, query, variables)
+    if "" in tag_depths:
+        variables["tags_first"] = tags_page_size(tag_depths[""])
+    data = await query_repository(
+        session,
+        [
+            *(scope_to_query[scope] for scope in scopes),
+            *(branch_query(i) for i in range(len(branches))),
+            *(tags_query(f"tags_{i}") for i in range(len(tag_prefixes))),
+            *([README_PROBES] if with_metadata and readme_hint is None else []),
+            HEADS
+        ],
+        variables
+    )
     repo_data = data["repository"]
+    readme_key = (repo_data.get("head") or {}).get("target", {}).get("oid")
 
     default_branch = repo_data.get("defaultBranchRef", {}).get("name", "master")
+    known_branches = {
+        name: grab_branch(f"{owner}/{repo}", node) if node else None
+        for name, node in zip(
+            branches,
+            (repo_data.get(f"branch_{i}") for i in range(len(branches)))
+        )
+    }
+    if (default_ref := repo_data.get("defaultBranchRef")) and "target" in default_ref:
+        known_branches[default_branch] = grab_branch(f"{owner}/{repo}", default_ref)
+
+    readme = None
+    if with_metadata:
+        if readme_hint is None:
+            readme = await locate_readme(session, owner, repo, default_branch, repo_data)
+        else:
+            readme = readme_hint[1]
+            if readme_hint[0] != readme_key:
+                # The head moved.  The README most likely stayed where it was;
+                # without a key the next crawl sends the probes along.
+                readme_key = None
 
     return {
         "metadata": drop_falsy({
@@ -299,12 +695,7 @@ async def fetch_github_info(
             "description": repo_data.get("description"),
             "homepage": repo_data.get("homepageUrl") or repo_data.get("url"),
             "author": repo_data.get("owner", {}).get("login"),
-            "readme": find_readme_url(
-                repo_data.get("files", {}).get("entries", []),
-                owner,
-                repo,
-                default_branch,
-            ),
+            "readme": readme,
             "issues": repo_data.get("issuesUrl"),
             "donate": (repo_data.get("fundingLinks") or [{}])[0].get("url"),
             "default_branch": default_branch,
@@ -314,10 +705,91 @@ async def fetch_github_info(
         }) if "METADATA" in scopes else {},
         "tags": TagPager(session, owner, repo, initial_data=repo_data.get("tags")),
         "branches": BranchesPager(session, owner, repo, initial_data=repo_data.get("branches")),
+        "branch": BranchLookup(session, owner, repo, initial_data=known_branches),
+        "tags_with_prefix": PrefixedTags(session, owner, repo, initial_data={
+            prefix: repo_data[f"tags_{i}"]
+            for i, prefix in enumerate(tag_prefixes)
+            if repo_data.get(f"tags_{i}")
+        }),
+        "heads": grab_heads(repo_data, branches),
+        "readme_key": readme_key,
         "rate_limit_info": data["rate_limit_info"],
     }
 
 
+async def locate_readme(
+    session: aiohttp.ClientSession,
+    owner: str,
+    repo: str,
+    branch: str,
+    probes: dict
+) -> Url | None:
+    """
+    Find the README of the repository, given the answers to README_PROBES.
+    """
+    for i, name in enumerate(README_CANDIDATES):
+        if probes.get(f"readme_{i}"):
+            return f"https://raw.githubusercontent.com/{owner}/{repo}/{branch}/{name}"
+
+    # An unusual spelling, or there is no README
+    variables = {"owner": owner, "name": repo, "branch_ex": "HEAD:"}
+    data = await query_repository(session, [ROOT_TREE], variables)
+    entries = (data["repository"].get("files") or {}).get("entries", [])
+    return find_readme_url(entries, owner, repo, branch)
+
+
+async def fetch_github_heads(
+    session: aiohttp.ClientSession,
+    github_url: str,
+    branches: Iterable[str] = ()
+) -> str | None:
+    """
+    Fetch only the signature of the repository's heads.  Compare it with the
+    "heads" of a previous `fetch_github_info` to decide if a full fetch is due.
+    """
+    owner, repo = parse_owner_repo(github_url)
+    branches = list(branches)
+    data = await query_repository(
+        session,
+        [HEADS, *(branch_query(i) for i in range(len(branches)))],
+        {
+            "owner": owner,
+            "name": repo,
+            **{f"branch_{i}": f"refs/heads/{name}" for i, name in enumerate(branches)},
+        }
+    )
+    return grab_heads(data["repository"], branches)
+
+
+def grab_heads(repo_data: dict, branches: Iterable[str] = ()) -> str | None:
+    """
+    Condense the HEADS fragment into one comparable string, e.g.
+    "<head-oid> v1.2.3@<tag-oid>", followed by "refs/heads/<name>@<oid>"
+    for each of the named `branches` (queried as `branch_{i}`).  Returns
+    None for empty repositories.
+    """
+    head = (repo_data.get("head") or {}).get("target", {}).get("oid")
+    if not head:
+        return None
+    signature = head
+    for node in (repo_data.get("latest_tag") or {}).get("nodes", []):
+        signature = f"{head} {node['name']}@{node['target']['oid']}"
+    named = sorted(
+        (name, ((repo_data.get(f"branch_{i}") or {}).get("target") or {}).get("oid", ""))
+        for i, name in enumerate(branches)
+    )
+    return " ".join([signature, *(f"refs/heads/{name}@{oid}" for name, oid in named)])
+
+
+def branches_of_heads(signature: str) -> list[str]:
+    """The named branches in a signature of `grab_heads`."""
+    return [
+        token.removeprefix("refs/heads/").rsplit("@", 1)[0]
+        for token in signature.split(" ")
+        if token.startswith("refs/heads/")
+    ]
+
+
 def grab_tags(repo: str, entries) -> list[TagInfo]:
     tags: list[TagInfo] = []
     for node in entries["nodes"]:
@@ -337,19 +809,20 @@ def grab_tags(repo: str, entries) -> list[TagInfo]:
 
 
 def grab_branches(repo: str, entries) -> list[BranchInfo]:
-    branches: list[BranchInfo] = []
-    for node in entries.get("nodes", []):
-        commit = node["target"]
-        branch_name = node["name"]
-        date = commit["committedDate"][:19].replace('T', ' ')
-        branches.append({
-            "name": branch_name,
-            "version": re.sub(r'\D', '.', date),
-            "sha": commit["oid"],
-            "date": date,
-            "url": f"https://codeload.github.com/{repo}/zip/{branch_name}"
-        })
-    return branches
+    return [grab_branch(repo, node) for node in entries.get("nodes", [])]
+
+
+def grab_branch(repo: str, node) -> BranchInfo:
+    commit = node["target"]
+    branch_name = node["name"]
+    date = commit["committedDate"][:19].replace('T', ' ')
+    return {
+        "name": branch_name,
+        "version": re.sub(r'\D', '.', date),
+        "sha": commit["oid"],
+        "date": date,
+        "url": f"https://codeload.github.com/{repo}/zip/{branch_name}"
+    }
 
 
 def strip_possible_prefix(version: str) -> str:
@@ -370,14 +843,17 @@ class TagPager:
         session: aiohttp.ClientSession,
         owner: str,
         repo: str,
-        initial_data: dict | None = None
+        initial_data: dict | None = None,
+        prefix: str = ""
     ):
         self._session = session
         self.owner = owner
         self.repo = repo
+        self.prefix = prefix
         self._cache: list[TagInfo] = []
         self._fetched_all = False
         self._next_cursor: str | None = None
+        self._lock = asyncio.Lock()
 
         if initial_data:
             self._process_tags_data(initial_data)
@@ -394,24 +870,28 @@ class TagPager:
         return self._generator()
 
     async def _generator(self):
-        for tag in self._cache:
-            yield tag
-
+        # Iterate by index: concurrent iterations share the pages fetched so
+        # far, and only one of them fetches the next page.
+        i = 0
         while True:
+            while i < len(self._cache):
+                yield self._cache[i]
+                i += 1
             if self._fetched_all:
                 break
-
-            query = build_query([TAGS])
-            variables = {
-                "owner": self.owner,
-                "name": self.repo,
-                "tags_after": self._next_cursor
-            }
-            result = await make_graphql_query(self._session, query, variables)
-            new_tags = self._process_tags_data(result["repository"]["tags"])
-
-            for tag in new_tags:
-                yield tag
+            async with self._lock:
+                if i == len(self._cache) and not self._fetched_all:
+                    await self._fetch_next_page()
+
+    async def _fetch_next_page(self) -> None:
+        variables = {
+            "owner": self.owner,
+            "name": self.repo,
+            "tags_after": self._next_cursor,
+            "tags_query": self.prefix or None
+        }
+        result = await query_repository(self._session, [TAGS], variables)
+        self._process_tags_data(result["repository"]["tags"])
 
     async def prefetch(self):
         """Optional helper to fetch and cache all tags eagerly."""
@@ -419,6 +899,32 @@ class TagPager:
             pass
 
 
+class PrefixedTags:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        owner: str,
+        repo: str,
+        initial_data: dict[str, dict] | None = None
+    ):
+        self._session = session
+        self.owner = owner
+        self.repo = repo
+        self._pagers: dict[str, TagPager] = {
+            prefix: TagPager(session, owner, repo, initial_data=data, prefix=prefix)
+            for prefix, data in (initial_data or {}).items()
+        }
+
+    def __call__(self, prefix: str) -> TagPager:
+        """
+        Return the tags matching `prefix`.  Note that GitHub filters for names
+        *containing* the prefix, check with `startswith` again.
+        """
+        if prefix not in self._pagers:
+            self._pagers[prefix] = TagPager(self._session, self.owner, self.repo, prefix=prefix)
+        return self._pagers[prefix]
+
+
 class BranchesPager:
     def __init__(
         self,
@@ -433,6 +939,7 @@ class BranchesPager:
         self._cache: list[BranchInfo] = []
         self._fetched_all = False
         self._next_cursor: str | None = None
+        self._lock = asyncio.Lock()
 
         if initial_data:
             self._process_branch_data(initial_data)
@@ -449,25 +956,27 @@ class BranchesPager:
         return self._generator()
 
     async def _generator(self):
-        for branch in self._cache:
-            yield branch
-
+        # Iterate by index: concurrent iterations share the pages fetched so
+        # far, and only one of them fetches the next page.
+        i = 0
         while True:
+            while i < len(self._cache):
+                yield self._cache[i]
+                i += 1
             if self._fetched_all:
                 break
-
-            query = build_query([BRANCHES])
-            variables = {
-                "owner": self.owner,
-                "name": self.repo,
-                "branches_after": self._next_cursor
-            }
-            result = await make_graphql_query(self._session, query, variables)
-            branch_data = result["repository"]["branches"]
-            new_branches = self._process_branch_data(branch_data)
-
-            for branch in new_branches:
-                yield branch
+            async with self._lock:
+                if i == len(self._cache) and not self._fetched_all:
+                    await self._fetch_next_page()
+
+    async def _fetch_next_page(self) -> None:
+        variables = {
+            "owner": self.owner,
+            "name": self.repo,
+            "branches_after": self._next_cursor
+        }
+        result = await query_repository(self._session, [BRANCHES], variables)
+        self._process_branch_data(result["repository"]["branches"])
 
     async def prefetch(self):
         """Optional: Eagerly load all branches."""
@@ -475,6 +984,33 @@ class BranchesPager:
             pass
 
 
+class BranchLookup:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        owner: str,
+        repo: str,
+        initial_data: dict[str, BranchInfo | None] | None = None
+    ):
+        self._session = session
+        self.owner = owner
+        self.repo = repo
+        self._cache: dict[str, BranchInfo | None] = dict(initial_data or {})
+
+    async def __call__(self, name: str) -> BranchInfo | None:
+        """Return the branch `name` or None if it doesn't exist."""
+        if name not in self._cache:
+            variables = {
+                "owner": self.owner,
+                "name": self.repo,
+                "branch_0": f"refs/heads/{name}"
+            }
+            result = await query_repository(self._session, [branch_query(0)], variables)
+            node = result["repository"].get("branch_0")
+            self._cache[name] = grab_branch(f"{self.owner}/{self.repo}", node) if node else None
+        return self._cache[name]
+
+
 if __name__ == "__main__":
     import sys
 
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from abc import ABC, abstractmethod
 import json
 import aiohttp
 import asyncio
@@ -6,14 +7,19 @@ import os
 import re
 from datetime import datetime, timedelta
 from urllib.parse import urlparse, quote
-from typing import AsyncIterable, TypedDict, Literal, Iterable
+from weakref import WeakKeyDictionary
+from typing import AsyncIterable, Awaitable, Callable, TypedDict, Literal, Iterable
 
+from .governor import governor_for
+from .ratelimit import limiter_for
+from .retry import with_retry
 from .utils import drop_falsy, err
 
 QueryScope = Literal["METADATA", "TAGS", "BRANCHES"]
 Url = str
 Sha = str
 IsoTimestamp = str
+ReadmeHint = tuple[str | None, Url | None]  # the key it's valid for, the README url
 
 
 class RepoMetadata(TypedDict, total=False):
@@ -47,9 +53,13 @@ class RepoInfo(TypedDict):
     metadata: RepoMetadata
     tags: AsyncIterable[TagInfo]
     branches: AsyncIterable[BranchInfo]
+    branch: Callable[[str], Awaitable[BranchInfo | None]]
+    tags_with_prefix: Callable[[str], AsyncIterable[TagInfo]]
+    readme_key: str | None  # ref. ReadmeHint
 
 
 GITLAB_API_URL = "https://gitlab.com/api/v4"
+GITLAB_GRAPHQL_URL = "https://gitlab.com/api/graphql"
 _readme_filenames = {
     'readme', 'readme.txt', 'readme.md', 'readme.mkd', 'readme.mdown',
     'readme.markdown', 'readme.textile', 'readme.creole', 'readme.rst'
@@ -61,6 +71,47 @@ if not os.getenv("GITLAB_TOKEN"):
         "Running anonymously."
     )
 
+# With GITLAB_GRAPHQL=1 we fetch the metadata, the root tree and the head of
+# the default branch of concurrently crawled projects with one GraphQL query
+# (ref: ProjectBatcher) instead of two to three REST requests per project.
+# GitLab's GraphQL API has no tags, so the tags, other branches, and further
+# pages still come from the REST API.
+USE_GRAPHQL = os.getenv("GITLAB_GRAPHQL", "") not in ("", "0")
+BATCH_WINDOW = 0.05   # seconds to wait for more projects
+MAX_BATCH_SIZE = 20   # projects per query, GitLab limits the query complexity
+PROJECTS = """
+query GetProjects($fullPaths: [String!], $first: Int) {
+  projects(fullPaths: $fullPaths, first: $first) {
+    nodes {
+      id
+      name
+      description
+      webUrl
+      fullPath
+      lastActivityAt
+      namespace {
+        path
+      }
+      repository {
+        rootRef
+        tree {
+          lastCommit {
+            sha
+            committedDate
+          }
+          blobs(first: 100) {
+            nodes {
+              name
+              type
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
 
 def parse_owner_repo(url: str):
     parts = urlparse(url)
@@ -74,10 +125,36 @@ async def fetch_(session: aiohttp.ClientSession, url: str):
     headers = {}
     if token := os.getenv("GITLAB_TOKEN"):
         headers["PRIVATE-TOKEN"] = token
-    async with session.get(url, headers=headers) as resp:
-        resp.raise_for_status()
-        data = await resp.json()
-        return data, dict(resp.headers)
+
+    limiter = limiter_for(session, url)
+
+    async def get():
+        await limiter.acquire()
+        async with governor_for(session, url).slot():
+            async with session.get(url, headers=headers) as resp:
+                limiter.update(resp.headers)
+                resp.raise_for_status()
+                data = await resp.json()
+                return data, dict(resp.headers)
+    return await with_retry(get)
+
+
+async def post_graphql(session: aiohttp.ClientSession, query: str, variables: dict) -> dict:
+    headers = {}
+    if token := os.getenv("GITLAB_TOKEN"):
+        headers["Authorization"] = f"Bearer {token}"
+
+    limiter = limiter_for(session, GITLAB_GRAPHQL_URL)
+    await limiter.acquire()
+    async with governor_for(session, GITLAB_GRAPHQL_URL).slot():
+        async with session.post(
+            GITLAB_GRAPHQL_URL,
+            json={"query": query, "variables": variables},
+            headers=headers
+        ) as resp:
+            limiter.update(resp.headers)
+            resp.raise_for_status()
+            return await resp.json()
 
 
 async def fetch_json(session: aiohttp.ClientSession, url: str):
@@ -85,12 +162,25 @@ async def fetch_json(session: aiohttp.ClientSession, url: str):
     return data
 
 
-async def fetch_repo_metadata(session: aiohttp.ClientSession, owner: str, repo: str) -> RepoMetadata:
+async def fetch_repo_metadata(
+    session: aiohttp.ClientSession,
+    owner: str,
+    repo: str,
+    readme_hint: ReadmeHint | None = None
+) -> tuple[RepoMetadata, str | None]:
+    """
+    Fetch the metadata, and the key under which to remember the README
+    location.  We only look for the README if `readme_hint` is outdated.
+    """
     encoded_path = quote(f"{owner}/{repo}", safe="")
     url = f"{GITLAB_API_URL}/projects/{encoded_path}"
     data = await fetch_json(session, url)
     default_branch = data.get("default_branch", "master")
-    readme_url = await find_readme_url(session, owner, repo, default_branch)
+    readme_key = data.get("last_activity_at")
+    if readme_hint and readme_key and readme_hint[0] == readme_key:
+        readme_url = readme_hint[1]
+    else:
+        readme_url = await find_readme_url(session, owner, repo, default_branch)
     return drop_falsy({
         "id": str(data.get("id")),
         "name": data.get("name"),
@@ -101,21 +191,156 @@ async def fetch_repo_metadata(session: aiohttp.ClientSession, owner: str, repo:
         "issues": data.get("web_url") + "/-/issues" if data.get("web_url") else None,
         "donate": None,  # Not available
         "default_branch": default_branch,
-    })
+    }), readme_key
 
 
 async def find_readme_url(session, owner, repo, branch) -> Url | None:
     encoded_path = quote(f"{owner}/{repo}", safe="")
     url = f"{GITLAB_API_URL}/projects/{encoded_path}/repository/tree?ref={branch}&per_page=100"
     data = await fetch_json(session, url)
-    for entry in data:
+    return pick_readme_url(data, owner, repo, branch)
+
+
+def pick_readme_url(entries, owner, repo, branch) -> Url | None:
+    for entry in entries:
         if entry.get("type") == "blob" and entry["name"].lower() in _readme_filenames:
             return f"https://gitlab.com/{owner}/{repo}/-/raw/{branch}/{entry['name']}"
     return None
 
 
-class _Pager:
+class ProjectBatcher:
+    """
+    Collect the projects requested by concurrent tasks for a short window
+    (`BATCH_WINDOW`) and fetch them with one `projects(fullPaths: [...])`
+    query.  Callers get the project node, or None if GitLab didn't return
+    it, e.g. because it was renamed; they fall back to the REST API then.
+    """
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+        self._pending: dict[str, list[asyncio.Future[dict | None]]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._inflight: set[asyncio.Task] = set()
+
+    async def project(self, full_path: str) -> dict | None:
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future[dict | None] = loop.create_future()
+        self._pending.setdefault(full_path.lower(), []).append(fut)
+        if len(self._pending) >= MAX_BATCH_SIZE:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(BATCH_WINDOW, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: dict[str, list[asyncio.Future[dict | None]]]) -> None:
+        try:
+            data = await post_graphql(
+                self._session, PROJECTS, {"fullPaths": list(batch), "first": len(batch)}
+            )
+            if errors := data.get("errors"):
+                err(f"GitLab GraphQL: {errors[0].get('message', errors[0])}")
+            nodes = ((data.get("data") or {}).get("projects") or {}).get("nodes") or []
+        except Exception as e:
+            for futs in batch.values():
+                for fut in futs:
+                    if not fut.done():
+                        fut.set_exception(e)
+            return
+
+        projects = {node["fullPath"].lower(): node for node in nodes if node}
+        for path, futs in batch.items():
+            for fut in futs:
+                if not fut.done():
+                    fut.set_result(projects.get(path))
+
+
+_batchers: WeakKeyDictionary[aiohttp.ClientSession, ProjectBatcher] = WeakKeyDictionary()
+
+
+async def query_project(session: aiohttp.ClientSession, owner: str, repo: str) -> dict | None:
+    """Fetch the project node, batched with the projects of concurrent callers."""
+    try:
+        batcher = _batchers[session]
+    except KeyError:
+        batcher = _batchers[session] = ProjectBatcher(session)
+    return await with_retry(lambda: batcher.project(f"{owner}/{repo}"))
+
+
+async def fetch_project_metadata(
+    session: aiohttp.ClientSession,
+    owner: str,
+    repo: str,
+    readme_hint: ReadmeHint | None = None
+) -> tuple[RepoMetadata, str | None, BranchInfo | None]:
+    """
+    Like `fetch_repo_metadata` but via GraphQL, plus the head of the default
+    branch which comes for free.  The README is found in the root tree we
+    get along.
+    """
+    project = await query_project(session, owner, repo)
+    if project is None:
+        return *(await fetch_repo_metadata(session, owner, repo, readme_hint)), None
+
+    repository = project.get("repository") or {}
+    tree = repository.get("tree") or {}
+    default_branch = repository.get("rootRef") or "master"
+    head = None
+    if commit := tree.get("lastCommit"):
+        head = grab_branch(owner, repo, {
+            "name": default_branch,
+            "commit": {"id": commit["sha"], "committed_date": commit["committedDate"]},
+        })
+    web_url = project.get("webUrl")
+    return drop_falsy({
+        "id": project["id"].rsplit("/", 1)[-1],  # "gid://gitlab/Project/123"
+        "name": project.get("name"),
+        "description": project.get("description"),
+        "homepage": web_url,
+        "author": (project.get("namespace") or {}).get("path"),
+        "readme": pick_readme_url(
+            (tree.get("blobs") or {}).get("nodes", []), owner, repo, default_branch
+        ),
+        "issues": web_url + "/-/issues" if web_url else None,
+        "donate": None,  # Not available
+        "default_branch": default_branch,
+    }), project.get("lastActivityAt"), head
+
+
+class _Pager(ABC):
     _next_url: Url | None
+    _cache: list
+    _lock: asyncio.Lock
+
+    def __aiter__(self):
+        return self._generator()
+
+    async def _generator(self):
+        # Iterate by index: concurrent iterations share the pages fetched so
+        # far, and only one of them fetches the next page.
+        i = 0
+        while True:
+            while i < len(self._cache):
+                yield self._cache[i]
+                i += 1
+            if not self._next_url:
+                break
+            async with self._lock:
+                if i == len(self._cache) and self._next_url:
+                    await self._fetch_next_page()
+
+    @abstractmethod
+    async def _fetch_next_page(self) -> None:
+        """Append the next page to `_cache` and advance `_next_url`."""
 
     def _get_next_url(self, headers: dict) -> Url | None:
         # GitLab paginates with 'X-Next-Page' header
@@ -131,36 +356,44 @@ class _Pager:
 
 
 class TagPager(_Pager):
-    def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str):
+    def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str, prefix: str = ""):
         self._session = session
         self.owner = owner
         self.repo = repo
         self._next_url = f"{GITLAB_API_URL}/projects/{quote(owner + '/' + repo, safe='')}/repository/tags?per_page=100"
+        if prefix:
+            # "^" anchors the search at the start of the tag name
+            self._next_url += f"&search={quote('^' + prefix, safe='')}"
         self._cache = []
+        self._lock = asyncio.Lock()
 
-    def __aiter__(self):
-        return self._generator()
+    async def _fetch_next_page(self) -> None:
+        assert self._next_url
+        data, headers = await fetch_(self._session, self._next_url)
+        self._cache.extend(
+            {
+                "name": tag["name"],
+                "url": tag.get("web_url") or f"https://gitlab.com/{self.owner}/{self.repo}/-/archive/{tag['name']}/{self.repo}-{tag['name']}.zip",
+                "date": tag.get("commit", {}).get("committed_date", "")[:19].replace('T', ' '),
+                "sha": tag.get("commit", {}).get("id", ""),
+            }
+            for tag in data
+        )
+        self._next_url = self._get_next_url(headers)
+
+
+class PrefixedTags:
+    def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str):
+        self._session = session
+        self.owner = owner
+        self.repo = repo
+        self._pagers: dict[str, TagPager] = {}
 
-    async def _generator(self):
-        for tag in self._cache:
-            yield tag
-
-        while self._next_url:
-            data, headers = await fetch_(self._session, self._next_url)
-            new_tags = [
-                {
-                    "name": tag["name"],
-                    "url": tag.get("web_url") or f"https://gitlab.com/{self.owner}/{self.repo}/-/archive/{tag['name']}/{self.repo}-{tag['name']}.zip",
-                    "date": tag.get("commit", {}).get("committed_date", "")[:19].replace('T', ' '),
-                    "sha": tag.get("commit", {}).get("id", ""),
-                }
-                for tag in data
-            ]
-            self._cache.extend(new_tags)
-            self._next_url = self._get_next_url(headers)
-
-            for tag_obj in new_tags:
-                yield tag_obj
+    def __call__(self, prefix: str) -> TagPager:
+        """Return the tags matching `prefix`, filtered on the server."""
+        if prefix not in self._pagers:
+            self._pagers[prefix] = TagPager(self._session, self.owner, self.repo, prefix=prefix)
+        return self._pagers[prefix]
 
 
 class BranchesPager(_Pager):
@@ -170,59 +403,95 @@ class BranchesPager(_Pager):
         self.repo = repo
         self._next_url = f"{GITLAB_API_URL}/projects/{quote(owner + '/' + repo, safe='')}/repository/branches?per_page=100"
         self._cache = []
+        self._lock = asyncio.Lock()
 
-    def __aiter__(self):
-        return self._generator()
+    async def _fetch_next_page(self) -> None:
+        assert self._next_url
+        data, headers = await fetch_(self._session, self._next_url)
+        self._cache.extend(grab_branch(self.owner, self.repo, branch) for branch in data)
+        self._next_url = self._get_next_url(headers)
 
-    async def _generator(self):
-        for branch in self._cache:
-            yield branch
-        next_url = self._next_url
-        while next_url:
-            data, headers = await fetch_(self._session, next_url)
-            new_branches = [
-                {
-                    "name": branch["name"],
-                    "version": re.sub(r"\\D", ".", branch.get("commit", {}).get("committed_date", "")[:19].replace('T', ' ')),
-                    "url": f"https://gitlab.com/{self.owner}/{self.repo}/-/tree/{branch['name']}",
-                    "date": branch.get("commit", {}).get("committed_date", "")[:19].replace('T', ' '),
-                    "sha": branch.get("commit", {}).get("id", ""),
-                }
-                for branch in data
-            ]
-            self._cache.extend(new_branches)
-            self._next_url = self._get_next_url(headers)
-
-            for branch_obj in new_branches:
-                yield branch_obj
+
+def grab_branch(owner: str, repo: str, branch: dict) -> BranchInfo:
+    date = branch.get("commit", {}).get("committed_date", "")[:19].replace('T', ' ')
+    return {
+        "name": branch["name"],
+        "version": re.sub(r"\D", ".", date),
+        "url": f"https://gitlab.com/{owner}/{repo}/-/tree/{branch['name']}",
+        "date": date,
+        "sha": branch.get("commit", {}).get("id", ""),
+    }
+
+
+class BranchLookup:
+    def __init__(self, session: aiohttp.ClientSession, owner: str, repo: str):
+        self._session = session
+        self.owner = owner
+        self.repo = repo
+        self._cache: dict[str, BranchInfo | None] = {}
+
+    async def __call__(self, name: str) -> BranchInfo | None:
+        """Return the branch `name` or None if it doesn't exist."""
+        if name not in self._cache:
+            url = (
+                f"{GITLAB_API_URL}/projects/{quote(self.owner + '/' + self.repo, safe='')}"
+                f"/repository/branches/{quote(name, safe='')}"
+            )
+            try:
+                data = await fetch_json(self._session, url)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 404:
+                    raise
+                data = None
+            self._cache[name] = grab_branch(self.owner, self.repo, data) if data else None
+        return self._cache[name]
 
 
 async def fetch_gitlab_info(
-    session: aiohttp.ClientSession, gitlab_url: str, scopes: Iterable[QueryScope]
+    session: aiohttp.ClientSession,
+    gitlab_url: str,
+    scopes: Iterable[QueryScope],
+    branches: Iterable[str] = (),
+    tag_prefixes: Iterable[str] = (),
+    readme_hint: ReadmeHint | None = None
 ) -> RepoInfo:
     owner, repo = parse_owner_repo(gitlab_url)
     tags = TagPager(session, owner, repo)
-    branches = BranchesPager(session, owner, repo)
-
-    metadata_task = (
-        fetch_repo_metadata(session, owner, repo)
-        if "METADATA" in scopes
-        else ready({})
-    )
+    branches_pager = BranchesPager(session, owner, repo)
+    branch = BranchLookup(session, owner, repo)
+    tags_with_prefix = PrefixedTags(session, owner, repo)
+
+    if "METADATA" not in scopes:
+        metadata_task = ready(({}, None, None))
+    elif USE_GRAPHQL:
+        metadata_task = fetch_project_metadata(session, owner, repo, readme_hint)
+    else:
+        metadata_task = with_no_head(fetch_repo_metadata(session, owner, repo, readme_hint))
     tags_task = (
         async_next_or_none(tags._generator()) if "TAGS" in scopes else ready()
     )
     branches_task = (
-        async_next_or_none(branches._generator())
+        async_next_or_none(branches_pager._generator())
         if "BRANCHES" in scopes
         else ready()
     )
-    metadata, _, _ = await asyncio.gather(metadata_task, tags_task, branches_task)
+    (metadata, readme_key, head), *_ = await asyncio.gather(
+        metadata_task,
+        tags_task,
+        branches_task,
+        *map(branch, branches),
+        *(async_next_or_none(tags_with_prefix(prefix)._generator()) for prefix in tag_prefixes)
+    )
+    if head:
+        branch._cache.setdefault(head["name"], head)
 
     return {
         "metadata": metadata,
         "tags": tags,
-        "branches": branches,
+        "branches": branches_pager,
+        "branch": branch,
+        "tags_with_prefix": tags_with_prefix,
+        "readme_key": readme_key,
     }
 
 
@@ -237,6 +506,10 @@ async def ready(value=None):
     return value
 
 
+async def with_no_head(metadata_task):
+    return *(await metadata_task), None
+
+
 if __name__ == "__main__":
     import sys
 
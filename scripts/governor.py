@@ -0,0 +1,123 @@
+from __future__ import annotations
+import asyncio
+from contextlib import asynccontextmanager
+import time
+from typing import AsyncIterator
+from urllib.parse import urlparse
+from weakref import WeakKeyDictionary
+
+import aiohttp
+
+from .utils import err
+
+
+# Limit the concurrent requests per host, e.g.
+#
+#   async with governor_for(session, url).slot():
+#       async with session.get(url) as resp:
+#           ...
+#
+# The window of allowed requests grows by one per window of healthy responses
+# and is halved when a host throttles us (429, GitHub's 403), fails (5xx,
+# network errors), or answers much slower than usual.  That's AIMD as known
+# from TCP: we find the parallelism a host tolerates and quickly back off if
+# it changes its mind.
+
+INITIAL_WINDOW = 4
+MIN_WINDOW = 1
+MAX_WINDOW = 32       # like generate_registry.MAX_CONCURRENCY
+LATENCY_SPIKE = 3.0   # times the usual latency
+MIN_LATENCY = 1.0     # seconds, faster responses are never a spike
+LATENCY_ALPHA = 0.1   # weight of the latest response for the usual latency
+BACKOFF_STATUS = {403, 429}
+
+
+class Governor:
+    def __init__(
+        self,
+        host: str,
+        initial: float = INITIAL_WINDOW,
+        minimum: int = MIN_WINDOW,
+        maximum: int = MAX_WINDOW
+    ):
+        self.host = host
+        self.window = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.peak = int(self.window)
+        self.backoffs = 0
+        self.latency: float | None = None   # EWMA of the healthy responses
+        self._last_backoff = 0.0
+        self._changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_overload(e):
+                self.back_off(f"{type(e).__name__} {getattr(e, 'status', '')}".strip())
+            raise
+        else:
+            self.observe(time.monotonic() - start)
+        finally:
+            async with self._changed:
+                self.in_flight -= 1
+                self._changed.notify_all()
+
+    def observe(self, latency: float) -> None:
+        usual = self.latency
+        if usual is not None and latency > max(LATENCY_SPIKE * usual, MIN_LATENCY):
+            self.back_off(f"latency {latency:.1f}s")
+            return
+        self.latency = latency if usual is None else (
+            LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * usual
+        )
+        self.window = min(self.maximum, self.window + 1 / self.window)
+        self.peak = max(self.peak, int(self.window))
+
+    def back_off(self, reason: str) -> None:
+        # Requests in flight when we back off tell the same story, so only
+        # back off once per usual round trip.
+        now = time.monotonic()
+        if now - self._last_backoff < max(self.latency or 0, MIN_LATENCY):
+            return
+        self._last_backoff = now
+        self.backoffs += 1
+        self.window = max(self.minimum, self.window / 2)
+        err(f"{self.host}: {reason}, concurrency window down to {int(self.window)}.")
+
+    def report(self) -> str:
+        return (
+            f"{self.host}: concurrency window {int(self.window)} "
+            f"(peak {self.peak}, {self.backoffs} backoffs)"
+        )
+
+
+def is_overload(e: BaseException) -> bool:
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status in BACKOFF_STATUS or e.status >= 500
+    return isinstance(e, (aiohttp.ClientConnectionError, TimeoutError))
+
+
+_governors: WeakKeyDictionary[aiohttp.ClientSession, dict[str, Governor]] = WeakKeyDictionary()
+
+
+def governor_for(session: aiohttp.ClientSession, url: str) -> Governor:
+    """The governor of `url`'s host, for the lifetime of `session`."""
+    host = urlparse(url).netloc
+    governors = _governors.setdefault(session, {})
+    try:
+        return governors[host]
+    except KeyError:
+        governor = governors[host] = Governor(host)
+        return governor
+
+
+def governors_of(session: aiohttp.ClientSession) -> list[Governor]:
+    return list(_governors.get(session, {}).values())
@@ -0,0 +1,137 @@
+from __future__ import annotations
+import asyncio
+from datetime import datetime
+import time
+from typing import Mapping
+from urllib.parse import urlparse
+from weakref import WeakKeyDictionary
+
+import aiohttp
+
+
+# Pace the requests to the REST hubs so that we don't run into 429s, e.g.
+#
+#   limiter = limiter_for(session, url)
+#   await limiter.acquire()
+#   async with session.get(url) as resp:
+#       limiter.update(resp.headers)
+#
+# Each host gets a token bucket.  It starts with the documented rate of the
+# host and follows the rate limit headers as soon as we see them: the points
+# left until the reset are spread over the time left.  GitLab sends
+# `RateLimit-Limit/-Remaining/-Reset`, Bitbucket `X-RateLimit-Limit` and
+# `X-RateLimit-NearLimit`; we read both spellings for both.
+
+DEFAULT_RATES = {  # requests per second
+    "gitlab.com": 2000 / 60,
+    "api.bitbucket.org": 1000 / 3600,
+}
+DEFAULT_RATE = 1.0
+BURST = 10          # requests we may send at once
+MIN_RATE = 1 / 60   # never stall completely, the reset may be late
+
+
+class RateLimiter:
+    def __init__(self, host: str, rate: float | None = None, burst: int = BURST):
+        self.host = host
+        self.rate = rate if rate is not None else DEFAULT_RATES.get(host, DEFAULT_RATE)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.requests = 0
+        self.throttled = 0.0    # seconds we waited
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset: int | None = None   # epoch seconds
+        self.near_limit = False
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        # One at a time, so that waiters are served in order.
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                self.throttled += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+            self.requests += 1
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        info = parse_rate_limit_headers(headers)
+        if not info:
+            return
+        self.limit = info.get("limit", self.limit)
+        self.near_limit = info.get("near_limit", False)
+        if "remaining" in info:
+            self.remaining = info["remaining"]
+        if "reset" in info:
+            self.reset = info["reset"]
+
+        rate = DEFAULT_RATES.get(self.host, DEFAULT_RATE)
+        if self.remaining is not None and self.reset is not None:
+            seconds_left = max(self.reset - time.time(), 1)
+            rate = self.remaining / seconds_left
+        if self.near_limit:
+            rate /= 2
+        self._refill()
+        self.rate = max(rate, MIN_RATE)
+
+    def report(self) -> str:
+        parts = [f"{self.host}: {self.requests} requests"]
+        if self.remaining is not None:
+            parts.append(
+                f"{self.remaining}/{self.limit} left" if self.limit else f"{self.remaining} left"
+            )
+        if self.reset is not None:
+            parts.append(f"resets at {datetime.fromtimestamp(self.reset).strftime('%H:%M:%S')}")
+        if self.near_limit:
+            parts.append("near the limit")
+        if self.throttled:
+            parts.append(f"waited {self.throttled:.0f}s")
+        return ", ".join(parts)
+
+
+def parse_rate_limit_headers(headers: Mapping[str, str]) -> dict:
+    info: dict = {}
+    for key, names in (
+        ("limit", ("RateLimit-Limit", "X-RateLimit-Limit")),
+        ("remaining", ("RateLimit-Remaining", "X-RateLimit-Remaining")),
+        ("reset", ("RateLimit-Reset", "X-RateLimit-Reset")),
+    ):
+        for name in names:
+            try:
+                info[key] = int(headers[name])
+                break
+            except (KeyError, ValueError):
+                continue
+    if "reset" in info and info["reset"] < 10**9:
+        # Seconds until the reset instead of a timestamp
+        info["reset"] += int(time.time())
+    if (near_limit := headers.get("X-RateLimit-NearLimit")) is not None:
+        info["near_limit"] = near_limit.lower() == "true"
+    return info
+
+
+_limiters: WeakKeyDictionary[aiohttp.ClientSession, dict[str, RateLimiter]] = WeakKeyDictionary()
+
+
+def limiter_for(session: aiohttp.ClientSession, url: str) -> RateLimiter:
+    """The rate limiter of `url`'s host, for the lifetime of `session`."""
+    host = urlparse(url).netloc
+    limiters = _limiters.setdefault(session, {})
+    try:
+        return limiters[host]
+    except KeyError:
+        limiter = limiters[host] = RateLimiter(host)
+        return limiter
+
+
+def limiters_of(session: aiohttp.ClientSession) -> list[RateLimiter]:
+    return list(_limiters.get(session, {}).values())
@@ -0,0 +1,103 @@
+from __future__ import annotations
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+import random
+import time
+from typing import Awaitable, Callable, Iterator, Mapping
+
+import aiohttp
+
+from .utils import err
+
+
+# Retry transient errors of the hubs within the run, e.g.
+#
+#   data = await with_retry(lambda: fetch_json(session, url))
+#
+# Only errors which may go away by themselves are retried: network errors,
+# timeouts, 5xx, 429 and GitHub's secondary rate limit (a 403 with
+# `Retry-After`).  We sleep as long as the server asks us to, otherwise with
+# exponential backoff and full jitter.  We never sleep past the deadline of
+# the current package (ref: `deadline`); then the error is raised right away
+# and the package is retried in a later run as before.
+
+MAX_ATTEMPTS = 4
+BASE_DELAY = 1.0    # seconds, doubled with every attempt
+MAX_DELAY = 30.0    # seconds, cap for the backoff, not for `Retry-After`
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+_deadline: ContextVar[float | None] = ContextVar("retry_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """Don't retry past `seconds` from now, in this task and the ones it starts."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+async def with_retry[T](
+    call: Callable[[], Awaitable[T]],
+    attempts: int = MAX_ATTEMPTS
+) -> T:
+    attempt = 1
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            if attempt >= attempts or not is_retryable(e):
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** (attempt - 1)))
+            if (end := _deadline.get()) is not None and time.monotonic() + delay > end:
+                raise
+            err(f"{describe(e)}; retrying in {delay:.1f}s ({attempt}/{attempts - 1}).")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status in RETRYABLE_STATUS or (
+            e.status == 403 and is_secondary_rate_limit(e.headers or {})
+        )
+    return isinstance(e, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, TimeoutError))
+
+
+def is_secondary_rate_limit(headers: Mapping[str, str]) -> bool:
+    # GitHub answers with a 403 and either tells us when to come back or
+    # reports the primary limit as used up.
+    return "Retry-After" in headers or headers.get("x-ratelimit-remaining") == "0"
+
+
+def retry_after(e: BaseException) -> float | None:
+    """The seconds the server asks us to wait, if any."""
+    headers = getattr(e, "headers", None) or {}
+    if value := headers.get("Retry-After"):
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    if headers.get("x-ratelimit-remaining") == "0" and (reset := headers.get("x-ratelimit-reset")):
+        try:
+            return max(0.0, int(reset) - time.time())
+        except ValueError:
+            return None
+    return None
+
+
+def describe(e: BaseException) -> str:
+    if isinstance(e, aiohttp.ClientResponseError):
+        url = getattr(e.request_info, "url", None)
+        return f"{e.status} {e.message}" + (f" for {url}" if url else "")
+    return f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
@@ -0,0 +1,89 @@
+from __future__ import annotations
+import heapq
+from typing import TYPE_CHECKING, Callable, Iterable, Mapping
+
+if TYPE_CHECKING:
+    from .crawl import PackageEntry
+
+type PackageName = str
+type Epoch = int
+
+
+class Schedule:
+    """
+    Index of the packages' `next_crawl` times as epoch seconds.
+
+    A heap with lazy deletion: `update` and `discard` only touch the dict of
+    current times, stale heap items are skipped when they surface.  Thus
+    `peek` is O(1) amortized, and popping the k most overdue packages is
+    O(k log n).
+    """
+    def __init__(self, items: Iterable[tuple[PackageName, Epoch]] = ()):
+        self._when: dict[PackageName, Epoch] = dict(items)
+        self._heap: list[tuple[Epoch, PackageName]] = [
+            (when, name) for name, when in self._when.items()
+        ]
+        heapq.heapify(self._heap)
+
+    @classmethod
+    def from_packages(cls, packages: Mapping[PackageName, PackageEntry]) -> Schedule:
+        return cls(
+            (name, entry["next_crawl"])
+            for name, entry in packages.items()
+            if "next_crawl" in entry
+            if not entry.get("removed")
+        )
+
+    def __contains__(self, name: PackageName) -> bool:
+        return name in self._when
+
+    def __len__(self) -> int:
+        return len(self._when)
+
+    def get(self, name: PackageName) -> Epoch | None:
+        return self._when.get(name)
+
+    def update(self, name: PackageName, when: Epoch) -> None:
+        self._when[name] = when
+        heapq.heappush(self._heap, (when, name))
+
+    def discard(self, name: PackageName) -> None:
+        self._when.pop(name, None)
+
+    def peek(self) -> tuple[Epoch, PackageName] | None:
+        """Return the next due package without removing it."""
+        while self._heap:
+            when, name = self._heap[0]
+            if self._when.get(name) == when:
+                return when, name
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(
+        self,
+        now: Epoch,
+        limit: int,
+        accept: Callable[[PackageName], bool] = lambda name: True
+    ) -> list[PackageName]:
+        """
+        Pop up to `limit` packages due at `now`, most overdue first.  Packages
+        not passing `accept` are skipped but stay scheduled.  Picked packages
+        are not popped again, but keep their time until they're `update`d.
+        """
+        picked: dict[PackageName, None] = {}
+        skipped: list[tuple[Epoch, PackageName]] = []
+        while len(picked) < limit and (item := self.peek()) and item[0] <= now:
+            heapq.heappop(self._heap)
+            when, name = item
+            if name in picked:
+                continue
+            if accept(name):
+                picked[name] = None
+            else:
+                skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        return list(picked)
+
+    def count_due(self, now: Epoch) -> int:
+        return sum(1 for when in self._when.values() if when <= now)
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from datetime import datetime, timezone
 import re
 import sys
 from urllib.parse import urljoin
@@ -108,3 +109,16 @@ SEMVER_RE = re.compile(
 
 def is_semver(s: str) -> bool:
     return bool(SEMVER_RE.match(s))
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_timestamp(ts: str) -> int:
+    """Convert a "YYYY-MM-DD HH:MM:SS" UTC timestamp to epoch seconds."""
+    return int(datetime.fromisoformat(ts).replace(tzinfo=timezone.utc).timestamp())
+
+
+def format_timestamp(epoch: int) -> str:
+    """Convert epoch seconds to a "YYYY-MM-DD HH:MM:SS" UTC timestamp."""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime(TIMESTAMP_FORMAT)
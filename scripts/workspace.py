@@ -0,0 +1,456 @@
+from __future__ import annotations
+
+import argparse
+from collections.abc import Mapping, MutableMapping
+import json
+import os
+import sqlite3
+import sys
+from typing import TYPE_CHECKING, Any, Iterator, cast
+
+from .schedule import Schedule
+from .utils import format_timestamp, parse_timestamp
+
+if TYPE_CHECKING:
+    from .crawl import PackageEntry, Workspace
+
+# The workspace is stored either as one JSON file (`workspace.json`) or as an
+# SQLite database with one row per package.  Use `open_workspace` to get the
+# backend matching the file extension:
+#
+#   with open_workspace("./wrk/workspace.sqlite") as store:
+#       workspace = store.load()
+#       ...
+#       store.save(workspace)
+#
+# Both backends only write the entries that have been changed.  The JSON
+# backend appends them to a journal next to the snapshot, e.g.
+# `workspace.journal.jsonl`, which is replayed on load and folded into the
+# snapshot by `compact()`.  The SQLite backend upserts the rows and also loads
+# packages lazily, so load and save cost is proportional to the work done.
+#
+# In memory, all timestamps of an entry are epoch seconds.  On disk they are
+# "YYYY-MM-DD HH:MM:SS" strings.  (Ref: decode_entry and encode_entry)
+
+SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+COMPACT_AFTER = 5000  # journal lines
+TIMESTAMP_FIELDS = {
+    "removed", "first_seen", "last_seen", "next_crawl", "last_modified",
+    "last_changed", "failing_since", "last_crawled",
+}
+TIMESTAMP_LIST_FIELDS = {"changes"}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    name TEXT PRIMARY KEY,
+    next_crawl INTEGER,
+    source TEXT,
+    removed INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS packages_next_crawl ON packages (next_crawl);
+CREATE INDEX IF NOT EXISTS packages_source ON packages (source);
+CREATE INDEX IF NOT EXISTS packages_removed ON packages (removed);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def open_workspace(path: str) -> JsonWorkspace | SqliteWorkspace:
+    if path.endswith(SQLITE_EXTENSIONS):
+        return SqliteWorkspace(path)
+    return JsonWorkspace(path)
+
+
+class JsonWorkspace:
+    def __init__(self, path: str):
+        self.path = path
+        self.journal_path = f"{os.path.splitext(path)[0]}.journal.jsonl"
+        self._journal_lines = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path) or os.path.exists(self.journal_path)
+
+    def load(self) -> Workspace:
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding="utf-8") as f:
+                snapshot = json.load(f)
+        else:
+            snapshot = {"packages": {}, "dependencies": []}
+
+        packages = JsonPackages(snapshot["packages"])
+        self._journal_lines = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb+') as f:
+                journal = f.read()
+                # Cut off the last line of an interrupted write, otherwise
+                # the next save would append to it.
+                complete = journal.rfind(b"\n") + 1
+                if complete < len(journal):
+                    err(f"Drop unfinished line in {self.journal_path}: {journal[complete:]!r}")
+                    f.truncate(complete)
+            for line in journal[:complete].decode("utf-8").splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    err(f"Skip unreadable line in {self.journal_path}: {line!r}")
+                    continue
+                packages.replay(entry)
+                self._journal_lines += 1
+
+        return {
+            "packages": packages,
+            "dependencies": snapshot["dependencies"],
+            "schedule": Schedule.from_packages(packages),
+        }
+
+    def save(self, workspace: Workspace) -> None:
+        """
+        Append the changed packages to the journal.  If `workspace` has not
+        been loaded from this store, e.g. on import, write a new snapshot.
+        """
+        packages = workspace["packages"]
+        if not isinstance(packages, JsonPackages):
+            self.compact(workspace)
+            return
+
+        changed, deleted = packages.changed()
+        if changed or deleted:
+            with open(self.journal_path, 'a', encoding="utf-8") as f:
+                for name, entry in changed:
+                    f.write(serialize(entry) + "\n")
+                for name in deleted:
+                    f.write(json.dumps({"name": name, DELETED: True}, separators=(",", ":")) + "\n")
+            self._journal_lines += len(changed) + len(deleted)
+            packages.mark_saved(changed, deleted)
+
+        if self._journal_lines > COMPACT_AFTER:
+            self.compact(workspace)
+
+    def compact(self, workspace: Workspace) -> None:
+        """Write a new snapshot of `workspace` and drop the journal."""
+        # Write to a temporary file first so that an interrupted save never
+        # leaves a truncated workspace behind
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as f:
+            json.dump(
+                {
+                    "packages": {
+                        name: encode_entry(entry)
+                        for name, entry in workspace["packages"].items()
+                    },
+                    "dependencies": workspace["dependencies"],
+                },
+                f,
+                indent=2
+            )
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_lines = 0
+        packages = workspace["packages"]
+        if isinstance(packages, JsonPackages):
+            packages.mark_saved(*packages.changed())
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteWorkspace:
+    def __init__(self, path: str):
+        self.path = path
+        self._exists = os.path.exists(path)
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def exists(self) -> bool:
+        return self._exists
+
+    def load(self) -> Workspace:
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'dependencies'"
+        ).fetchone()
+        # The schedule is read from the indexed columns only, without
+        # loading the packages themselves.
+        schedule = Schedule(
+            self._conn.execute(
+                "SELECT name, next_crawl FROM packages "
+                "WHERE removed IS NULL AND next_crawl IS NOT NULL"
+            )
+        )
+        return {
+            "packages": SqlitePackages(self._conn),
+            "dependencies": json.loads(row[0]) if row else [],
+            "schedule": schedule,
+        }
+
+    def save(self, workspace: Workspace) -> None:
+        """
+        Upsert the changed packages.  If `workspace` has not been loaded from
+        this database, e.g. on import, its packages replace the stored ones.
+        """
+        packages = workspace["packages"]
+        with self._conn:
+            if isinstance(packages, SqlitePackages):
+                changed, deleted = packages.changed()
+            else:
+                self._conn.execute("DELETE FROM packages")
+                changed, deleted = list(packages.items()), []
+
+            rows = []
+            for name, entry in changed:
+                columns = decode_entry(entry)
+                rows.append((
+                    name,
+                    columns.get("next_crawl"),
+                    columns.get("source"),
+                    columns.get("removed"),
+                    serialize(entry),
+                ))
+            self._conn.executemany(
+                "DELETE FROM packages WHERE name = ?",
+                ((name,) for name in deleted)
+            )
+            self._conn.executemany(
+                """
+                INSERT INTO packages (name, next_crawl, source, removed, data)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    next_crawl = excluded.next_crawl,
+                    source = excluded.source,
+                    removed = excluded.removed,
+                    data = excluded.data
+                """,
+                rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('dependencies', ?)",
+                (json.dumps(workspace["dependencies"]),)
+            )
+        if isinstance(packages, SqlitePackages):
+            packages.mark_saved(changed, deleted)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def serialize(entry: PackageEntry) -> str:
+    return json.dumps(encode_entry(entry), ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_entry(entry: Mapping[str, Any]) -> PackageEntry:
+    """Return a copy of a stored `entry` with its timestamps as epoch seconds."""
+    decoded = dict(entry)
+    for field in TIMESTAMP_FIELDS & decoded.keys():
+        if isinstance(value := decoded[field], str):
+            decoded[field] = parse_timestamp(value)
+    for field in TIMESTAMP_LIST_FIELDS & decoded.keys():
+        decoded[field] = [
+            parse_timestamp(value) if isinstance(value, str) else value
+            for value in decoded[field]
+        ]
+    return cast("PackageEntry", decoded)
+
+
+def encode_entry(entry: Mapping[str, Any]) -> dict:
+    """Return a copy of `entry` with its timestamps formatted for storage."""
+    return {
+        key: (
+            format_timestamp(value) if key in TIMESTAMP_FIELDS and type(value) is int
+            else [format_timestamp(v) if type(v) is int else v for v in value]
+            if key in TIMESTAMP_LIST_FIELDS
+            else value
+        )
+        for key, value in entry.items()
+    }
+
+
+DELETED = "$deleted"  # marks a journal line as a deletion
+
+
+class TrackedPackages(MutableMapping[str, "PackageEntry"]):
+    """
+    Mapping of package names to entries which records the names assigned or
+    deleted since the last save.  `changed()` therefore only looks at those;
+    an entry that is mutated in place must be assigned again to be saved.
+    """
+    def __init__(self):
+        self._entries: dict[str, PackageEntry] = {}
+        self._stored: set[str] = set()
+        self._dirty: dict[str, None] = {}  # ordered set
+        self._deleted: set[str] = set()
+
+    def __getitem__(self, name: str) -> PackageEntry:
+        return self._entries[name]
+
+    def __setitem__(self, name: str, entry: PackageEntry) -> None:
+        self._entries[name] = entry
+        self._dirty[name] = None
+        self._deleted.discard(name)
+
+    def __delitem__(self, name: str) -> None:
+        self[name]
+        del self._entries[name]
+        self._dirty.pop(name, None)
+        self._deleted.add(name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def changed(self) -> tuple[list[tuple[str, PackageEntry]], list[str]]:
+        """Return the entries to upsert and the names to delete."""
+        return (
+            [(name, self._entries[name]) for name in self._dirty],
+            [name for name in self._deleted if name in self._stored]
+        )
+
+    def mark_saved(self, changed: list[tuple[str, PackageEntry]], deleted: list[str]) -> None:
+        self._stored.update(name for name, _ in changed)
+        self._stored.difference_update(deleted)
+        self._dirty.clear()
+        self._deleted.clear()
+
+
+class JsonPackages(TrackedPackages):
+    def __init__(self, packages: dict[str, PackageEntry]):
+        super().__init__()
+        for name, entry in packages.items():
+            self._entries[name] = decode_entry(entry)
+        self._stored.update(self._entries)
+
+    def replay(self, entry: PackageEntry) -> None:
+        """Apply one journal line."""
+        name = entry["name"]
+        if entry.get(DELETED):
+            self._entries.pop(name, None)
+            self._stored.discard(name)
+        else:
+            self._entries[name] = decode_entry(entry)
+            self._stored.add(name)
+
+
+class SqlitePackages(TrackedPackages):
+    """Lazy mapping over the `packages` table, rows are parsed on first access."""
+    def __init__(self, conn: sqlite3.Connection):
+        super().__init__()
+        self._conn = conn
+        self._loaded_all = False
+
+    def __getitem__(self, name: str) -> PackageEntry:
+        try:
+            return self._entries[name]
+        except KeyError:
+            pass
+        if name in self._deleted or self._loaded_all:
+            raise KeyError(name)
+        row = self._conn.execute(
+            "SELECT data FROM packages WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        self._stored.add(name)
+        entry = self._entries[name] = decode_entry(json.loads(row[0]))
+        return entry
+
+    def __iter__(self) -> Iterator[str]:
+        names = {row[0] for row in self._conn.execute("SELECT name FROM packages")}
+        return iter((names | self._entries.keys()) - self._deleted)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def values(self):
+        self._load_all()
+        return self._entries.values()
+
+    def items(self):
+        self._load_all()
+        return self._entries.items()
+
+    def _load_all(self) -> None:
+        if self._loaded_all:
+            return
+        for name, data in self._conn.execute("SELECT name, data FROM packages"):
+            if name not in self._entries and name not in self._deleted:
+                self._stored.add(name)
+                self._entries[name] = decode_entry(json.loads(data))
+        self._loaded_all = True
+
+
+def copy_workspace(src: str, dst: str) -> None:
+    with open_workspace(src) as source, open_workspace(dst) as target:
+        if not source.exists():
+            err(f"FATAL: Workspace '{src}' does not exist.")
+            sys.exit(1)
+        workspace = source.load()
+        packages = dict(workspace["packages"].items())
+        target.save({"packages": packages, "dependencies": workspace["dependencies"]})
+    print(f"Copied {len(packages)} packages from {src} to {dst}")
+
+
+def compact_workspace(path: str) -> None:
+    with open_workspace(path) as store:
+        if not isinstance(store, JsonWorkspace):
+            print(f"{path} is not journaled, nothing to do.")
+            return
+        workspace = store.load()
+        store.compact(workspace)
+    print(f"Compacted {path}")
+
+
+def err(*args, **kwargs) -> None:
+    print(*args, **kwargs, file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Convert the workspace between its JSON and SQLite formats, "
+            "or compact the journal of a JSON workspace."
+        )
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_ = subparsers.add_parser("import", help="Import a JSON workspace into SQLite.")
+    import_.add_argument("source", help="Path to the JSON workspace, e.g. workspace.json")
+    import_.add_argument("target", help="Path to the SQLite workspace, e.g. workspace.sqlite")
+    export = subparsers.add_parser("export", help="Export an SQLite workspace as JSON.")
+    export.add_argument("source", help="Path to the SQLite workspace, e.g. workspace.sqlite")
+    export.add_argument("target", help="Path to the JSON workspace, e.g. workspace.json")
+    compact = subparsers.add_parser(
+        "compact", help="Fold the journal of a JSON workspace into its snapshot."
+    )
+    compact.add_argument("source", help="Path to the JSON workspace, e.g. workspace.json")
+    parser.add_argument(
+        "--wd",
+        type=str,
+        default=".",
+        help="Working directory to resolve file paths (default: .)"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    wd = os.path.abspath(args.wd)
+    source = os.path.normpath(os.path.join(wd, args.source))
+    if args.command == "compact":
+        compact_workspace(source)
+    else:
+        target = os.path.normpath(os.path.join(wd, args.target))
+        copy_workspace(source, target)
@@ -0,0 +1,35 @@
+import os
+import sys
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts import bitbucket
+
+
+def tag(name, date):
+    return {"name": name, "target": {"hash": f"{name}-sha", "date": f"{date}T00:00:00+00:00"}}
+
+
+async def test_tags_are_fetched_newest_first_in_large_projected_pages(monkeypatch):
+    urls = []
+    pages = {
+        "page-2": {"values": [tag("st4-1.0.0", "2020-01-01")]},
+    }
+
+    async def fetch_json(session, url):
+        urls.append(url)
+        return pages.get(url) or {"values": [tag("st4-1.1.0", "2021-01-01")], "next": "page-2"}
+
+    monkeypatch.setattr(bitbucket, "fetch_json", fetch_json)
+    tags = [t async for t in bitbucket.TagPager(None, "o", "r", prefix="st4-")]
+
+    assert [t["name"] for t in tags] == ["st4-1.1.0", "st4-1.0.0"]
+    assert tags[0]["sha"] == "st4-1.1.0-sha"
+    assert urls[1] == "page-2"
+    query = parse_qs(urlparse(urls[0]).query)
+    assert query == {
+        "pagelen": ["100"],
+        "sort": ["-target.date"],
+        "fields": ["next,values.name,values.target.hash,values.target.date"],
+        "q": ['name ~ "st4-"'],
+    }
@@ -0,0 +1,540 @@
+import asyncio
+from collections import defaultdict
+import os
+import sys
+import time
+
+import aiohttp
+import aiohttp.web
+import pytest
+import yarl
+from multidict import CIMultiDict, CIMultiDictProxy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts import crawl as crawl_module
+from scripts.crawl import crawl, fingerprint
+
+
+PACKAGE = {
+    "name": "Foo",
+    "details": "https://github.com/example/Foo",
+    "releases": [{"sublime_text": ">4000", "tags": True}],
+    "source": "https://example.com/repository.json",
+    "schema_version": "3.0.0",
+}
+
+
+def make_existing(**kwargs):
+    now = int(time.time())
+    return {
+        "name": "Foo",
+        "releases": [{
+            "sublime_text": ">4000", "platforms": ["*"], "version": "1.0.0",
+            "url": "https://codeload.github.com/example/Foo/zip/1.0.0",
+            "date": "2020-01-01 00:00:00",
+        }],
+        "fingerprint": fingerprint(PACKAGE),
+        "heads": {"https://github.com/example/Foo": "abc 1.0.0@def"},
+        "last_crawled": now - 3600,
+        "last_seen": now - 3600,
+        **kwargs
+    }
+
+
+@pytest.fixture
+def heads(monkeypatch):
+    current = {"https://github.com/example/Foo": "abc 1.0.0@def"}
+
+    async def fetch_github_heads(session, url, branches=()):
+        return current[url]
+
+    async def crawl_package(session, package, existing):
+        return {**package, "releases": existing["releases"], "crawled": True}
+
+    monkeypatch.setattr(crawl_module, "fetch_github_heads", fetch_github_heads)
+    monkeypatch.setattr(crawl_module, "crawl_package", crawl_package)
+    return current
+
+
+async def test_unchanged_heads_only_bump_the_schedule(heads):
+    existing = make_existing()
+    out = await crawl(None, PACKAGE, existing)
+
+    assert "crawled" not in out
+    assert out["last_crawled"] == existing["last_crawled"]
+    assert out["last_seen"] > existing["last_seen"]
+    assert out["next_crawl"] > out["last_seen"]
+
+
+async def test_quiet_packages_are_probed_between_full_crawls(heads):
+    now = int(time.time())
+    # Quiet packages come back after the max interval plus jitter
+    out = await crawl(None, PACKAGE, make_existing(last_crawled=now - 27 * 3600))
+    assert "crawled" not in out
+
+    out = await crawl(None, PACKAGE, make_existing(last_crawled=now - 5 * 24 * 3600))
+    assert out["crawled"]
+
+
+async def test_moved_heads_trigger_a_full_crawl(heads):
+    heads["https://github.com/example/Foo"] = "xyz 1.0.0@def"
+    out = await crawl(None, PACKAGE, make_existing())
+
+    assert out["crawled"]
+
+
+async def test_changed_registry_entry_triggers_a_full_crawl(heads):
+    out = await crawl(None, PACKAGE, make_existing(fingerprint="outdated"))
+
+    assert out["crawled"]
+
+
+async def test_packages_listed_again_are_fully_crawled(heads):
+    workspace = {"packages": {"Foo": make_existing()}, "dependencies": []}
+    crawl_module.maintenance({"packages": []}, workspace)
+    existing = workspace["packages"]["Foo"]
+    assert existing["removed"]
+
+    out = await crawl(None, PACKAGE, existing)
+
+    assert out["crawled"]
+    assert "removed" not in out
+
+
+async def test_releases_at_the_same_commits_are_kept_as_they_were(repos):
+    # crawl_package resolves the release definitions in place
+    def fresh_package():
+        return {**PACKAGE, "releases": [dict(r) for r in PACKAGE["releases"]]}
+
+    existing = {
+        **await crawl(None, fresh_package(), {"name": "Foo"}, probe=False),
+        "last_changed": 1600000000,
+    }
+
+    out = await crawl_module.crawl_package(None, fresh_package(), existing)
+    assert out["releases"] is existing["releases"]
+    out = await crawl(None, fresh_package(), existing, probe=False)
+    assert out["releases"] is existing["releases"]
+    assert out["changes"] == existing["changes"]
+    assert out["last_changed"] == existing["last_changed"]
+
+    # Another tag on the same commit
+    release = existing["releases"][0]
+    out = await crawl(
+        None, fresh_package(), {**existing, "releases": [{**release, "version": "0.9.0"}]},
+        probe=False
+    )
+    assert out["releases"] == [release]
+    assert out["last_changed"] > existing["last_changed"]
+
+    out = await crawl(
+        None, fresh_package(), {**existing, "releases": [{**release, "sha": "moved"}]},
+        probe=False
+    )
+    assert out["releases"] == [release]
+    assert out["last_changed"] > existing["last_changed"]
+
+
+def test_checkpointer_saves_every_n_results():
+    saves = []
+    checkpointer = crawl_module.Checkpointer(lambda: saves.append(1), every=2, interval=3600)
+
+    checkpointer.tick()
+    assert saves == []
+    checkpointer.tick()
+    assert saves == [1]
+    checkpointer.flush()
+    assert saves == [1]
+
+
+def test_next_packages_to_crawl_picks_the_most_overdue_first():
+    now = int(time.time())
+
+    def ts(hours):
+        return now + hours * 3600
+
+    registry = {"packages": [
+        {"name": "Later"},
+        {"name": "Overdue"},
+        {"name": "New"},
+        {"name": "Tombstoned", "tombstoned": True},
+        {"name": "MoreOverdue"},
+    ]}
+    workspace = {"packages": {
+        "Later": {"name": "Later", "next_crawl": ts(1)},
+        "Overdue": {"name": "Overdue", "next_crawl": ts(-1)},
+        "Tombstoned": {"name": "Tombstoned", "next_crawl": ts(-3)},
+        "MoreOverdue": {"name": "MoreOverdue", "next_crawl": ts(-2)},
+    }, "dependencies": []}
+
+    picked = crawl_module.next_packages_to_crawl(registry, workspace, limit=10)
+    assert [p["name"] for p in picked] == ["MoreOverdue", "Overdue", "New"]
+
+    picked = crawl_module.next_packages_to_crawl(registry, workspace, limit=10)
+    assert [p["name"] for p in picked] == ["New"]
+
+
+def test_budget_learns_the_cost_per_package(monkeypatch):
+    info = {"limit": 5000, "remaining": 1500, "used": 3500, "reset": 100}
+    for key, value in info.items():
+        monkeypatch.setitem(crawl_module.rate_limit_info, key, value)
+
+    budget = crawl_module.Budget(info, reserve=500, estimated_cost=2)
+    assert budget.packages_left() == 500
+    assert not budget.exhausted()
+
+    # 40 packages cost 200 points, that is 5 each
+    monkeypatch.setitem(crawl_module.rate_limit_info, "remaining", 1300)
+    monkeypatch.setitem(crawl_module.rate_limit_info, "used", 3700)
+    for _ in range(40):
+        budget.record()
+    assert budget.spent == 200
+    assert budget.cost_per_package() == 5
+    assert budget.packages_left() == 160
+    # Packages still being crawled will spend their share too
+    assert budget.packages_left(in_flight=60) == 100
+
+    monkeypatch.setitem(crawl_module.rate_limit_info, "remaining", 520)
+    assert not budget.exhausted()
+    assert budget.exhausted(in_flight=4)
+    monkeypatch.setitem(crawl_module.rate_limit_info, "remaining", 503)
+    assert budget.exhausted()
+
+
+async def test_crawl_refuses_to_start_on_an_exhausted_budget(heads, monkeypatch):
+    budget = crawl_module.Budget(dict(crawl_module.rate_limit_info))
+    monkeypatch.setattr(budget, "exhausted", lambda: True)
+    with pytest.raises(crawl_module.BudgetExhausted):
+        await crawl(None, PACKAGE, make_existing(), budget=budget)
+
+
+async def test_used_up_tokens_skip_the_package_instead_of_failing_it(heads, monkeypatch):
+    async def fetch_github_heads(session, url, branches=()):
+        raise crawl_module.RateLimitExhausted("All GitHub tokens are used up")
+
+    monkeypatch.setattr(crawl_module, "fetch_github_heads", fetch_github_heads)
+    existing = make_existing()
+    with pytest.raises(crawl_module.BudgetExhausted):
+        await crawl(None, PACKAGE, existing)
+    assert "failing_since" not in existing
+
+
+def test_next_interval_follows_the_change_rate():
+    day = crawl_module.DAY
+    now = 1_000 * day
+    entry = {"last_modified": now - 14 * day}
+
+    # One release two weeks ago, then another one half a year later
+    existing = {"last_modified": now - 200 * day}
+    crawl_module.record_change(entry, existing)
+    assert entry["changes"] == [now - 200 * day, now - 14 * day]
+    assert entry["change_interval"] == 186 * day
+    assert crawl_module.next_interval(entry, now) == crawl_module.MAX_INTERVAL
+
+    # A busy package is crawled often, but not more often than the bounds allow
+    busy = {"last_modified": now - 3600, "change_interval": day}
+    assert crawl_module.next_interval(busy, now) == crawl_module.MIN_INTERVAL
+    assert crawl_module.next_interval(busy, now, (10, day)) == day // 48
+
+    # Unchanged releases do not count as a change
+    again = {"last_modified": entry["last_modified"]}
+    crawl_module.record_change(again, entry)
+    assert again["changes"] == entry["changes"]
+    assert again["change_interval"] == entry["change_interval"]
+
+    archived = {**busy, "archived_at": "2024-01-01T00:00:00Z"}
+    assert crawl_module.next_interval(archived, now) == crawl_module.ARCHIVED_INTERVAL
+
+
+def test_jitter_spreads_packages_deterministically():
+    hour = crawl_module.HOUR
+    intervals = {crawl_module.jittered(f"Package{i}", hour) for i in range(100)}
+    assert len(intervals) > 50
+    assert all(0.9 * hour <= i <= 1.1 * hour for i in intervals)
+    assert crawl_module.jittered("Foo", hour) == crawl_module.jittered("Foo", hour)
+
+
+def test_next_packages_to_crawl_works_ahead_on_light_runs():
+    now = int(time.time())
+    registry = {"packages": [{"name": f"P{i}"} for i in range(20)]}
+    # One package is due now, 16 within the next hour, 3 only tomorrow
+    workspace = {"packages": {
+        f"P{i}": {
+            "name": f"P{i}",
+            "next_crawl": now - 60 if i == 0 else now + i * 180 if i <= 16 else now + 86400
+        }
+        for i in range(20)
+    }, "dependencies": []}
+
+    picked = crawl_module.next_packages_to_crawl(registry, workspace, limit=10)
+    # 17 packages within 8 runs makes 3 per run
+    assert [p["name"] for p in picked] == ["P0", "P1", "P2"]
+
+
+async def test_circuit_breaker_skips_packages_of_a_hub_that_is_down(heads, monkeypatch):
+    hub_is_down = True
+
+    async def fetch_github_heads(session, url, branches=()):
+        if hub_is_down:
+            raise aiohttp.ServerDisconnectedError()
+        return heads[url]
+
+    monkeypatch.setattr(crawl_module, "fetch_github_heads", fetch_github_heads)
+    breakers = defaultdict(lambda: crawl_module.CircuitBreaker(threshold=2, cooldown=3600))
+
+    existing = make_existing()
+    out = await crawl(None, PACKAGE, existing, breakers=breakers)
+    assert "failing_since" in out
+
+    with pytest.raises(crawl_module.HubDown):
+        await crawl(None, PACKAGE, existing, breakers=breakers)
+    # Once open, we don't even try
+    with pytest.raises(crawl_module.HubDown):
+        await crawl(None, PACKAGE, existing, breakers=breakers)
+    assert breakers["github"].failures == 2
+
+    # After the cooldown, a success closes the breaker again
+    hub_is_down = False
+    breakers["github"].cooldown = 0
+    out = await crawl(None, PACKAGE, existing, breakers=breakers)
+    assert "failing_since" not in out
+    assert not breakers["github"].is_open()
+
+
+async def test_circuit_breaker_only_counts_against_the_failing_hub(monkeypatch):
+    url = yarl.URL("https://gitlab.com/api/v4/projects/example%2FOld")
+
+    async def crawl_package(session, package, existing):
+        raise aiohttp.ClientResponseError(
+            aiohttp.RequestInfo(url, "GET", CIMultiDictProxy(CIMultiDict()), url),
+            (), status=503, message="Service Unavailable"
+        )
+
+    monkeypatch.setattr(crawl_module, "crawl_package", crawl_package)
+    breakers = defaultdict(lambda: crawl_module.CircuitBreaker(threshold=1, cooldown=3600))
+
+    with pytest.raises(crawl_module.HubDown, match="gitlab"):
+        await crawl(None, MULTI_REPO_PACKAGE, {"name": "Multi"}, breakers=breakers)
+    assert breakers["gitlab"].is_open()
+    assert not breakers["github"].is_open()
+    assert not breakers["bitbucket"].is_open()
+
+
+async def test_requests_to_a_hub_that_hangs_time_out_and_open_its_breaker(monkeypatch):
+    async def hang(request):
+        await asyncio.sleep(0.5)
+        return aiohttp.web.Response()
+
+    app = aiohttp.web.Application()
+    app.router.add_get("/", hang)
+    runner = aiohttp.web.AppRunner(app)
+    await runner.setup()
+    site = aiohttp.web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+
+    async def crawl_package(session, package, existing):
+        async with session.get(f"http://{host}:{port}/"):
+            pass
+
+    async def fetch_rate_limit(session):
+        raise RuntimeError("no token")
+
+    monkeypatch.setattr(crawl_module, "crawl_package", crawl_package)
+    monkeypatch.setattr(crawl_module, "fetch_rate_limit", fetch_rate_limit)
+    monkeypatch.setattr(crawl_module, "REQUEST_TIMEOUT", aiohttp.ClientTimeout(total=0.05))
+    registry = {"packages": [
+        {"name": f"P{i}", "details": f"https://github.com/example/P{i}"}
+        for i in range(crawl_module.BREAKER_THRESHOLD + 2)
+    ]}
+    workspace = {"packages": {}, "dependencies": []}
+    try:
+        await crawl_module.main_(registry, workspace, None, limit=10, workers=1)
+    finally:
+        await runner.cleanup()
+
+    # The packages crawled before the breaker opened failed, the rest were skipped
+    assert len(workspace["packages"]) == crawl_module.BREAKER_THRESHOLD - 1
+    assert all("failing_since" in p for p in workspace["packages"].values())
+
+
+async def test_main_runs_a_bounded_pool_of_workers(monkeypatch):
+    running = 0
+    most = 0
+
+    async def fake_crawl(session, package, existing, **kwargs):
+        nonlocal running, most
+        running += 1
+        most = max(most, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {"name": package["name"], "next_crawl": int(time.time()) + 3600}
+
+    async def fetch_rate_limit(session):
+        raise RuntimeError("no token")
+
+    monkeypatch.setattr(crawl_module, "crawl", fake_crawl)
+    monkeypatch.setattr(crawl_module, "fetch_rate_limit", fetch_rate_limit)
+    registry = {"packages": [{"name": f"P{i}"} for i in range(10)]}
+    workspace = {"packages": {}, "dependencies": []}
+
+    await crawl_module.main_(registry, workspace, None, limit=10, workers=3)
+
+    assert most == 3
+    assert sorted(workspace["packages"]) == sorted(f"P{i}" for i in range(10))
+    assert all(name in workspace["schedule"] for name in workspace["packages"])
+
+
+async def test_main_stops_starting_packages_at_the_time_limit(monkeypatch):
+    async def fake_crawl(session, package, existing, **kwargs):
+        await asyncio.sleep(0.05)
+        return {"name": package["name"], "next_crawl": int(time.time()) + 3600}
+
+    async def fetch_rate_limit(session):
+        raise RuntimeError("no token")
+
+    monkeypatch.setattr(crawl_module, "crawl", fake_crawl)
+    monkeypatch.setattr(crawl_module, "fetch_rate_limit", fetch_rate_limit)
+    registry = {"packages": [{"name": f"P{i}"} for i in range(10)]}
+    workspace = {"packages": {}, "dependencies": []}
+
+    await crawl_module.main_(registry, workspace, None, limit=10, workers=2, time_limit=0.08)
+
+    assert 2 <= len(workspace["packages"]) <= 4
+
+
+async def test_fetch_info_shares_one_request_per_run(monkeypatch):
+    calls = []
+
+    async def fetch_github_info(
+        session, url, scopes, branches, tag_prefixes, readme_hint, tag_depths=None
+    ):
+        calls.append(url)
+        await asyncio.sleep(0.01)
+        if "Broken" in url:
+            raise aiohttp.ServerDisconnectedError()
+        return {"metadata": {"name": url}}
+
+    monkeypatch.setattr(crawl_module, "fetch_github_info", fetch_github_info)
+    session = aiohttp.ClientSession()
+    try:
+        url = "https://github.com/example/Foo"
+        first, second = await asyncio.gather(
+            crawl_module.fetch_info(session, url, {"METADATA"}),
+            crawl_module.fetch_info(session, url, ["METADATA"]),
+        )
+        assert first is second
+        assert calls == [url]
+
+        # Failures are not remembered
+        broken = "https://github.com/example/Broken"
+        for _ in range(2):
+            with pytest.raises(aiohttp.ServerDisconnectedError):
+                await crawl_module.fetch_info(session, broken, {"METADATA"})
+        assert calls == [url, broken, broken]
+
+        assert await crawl_module.fetch_info(session, "https://example.com/Foo", ()) is None
+    finally:
+        await session.close()
+
+
+async def test_fetch_info_keeps_only_the_latest_finished_infos(monkeypatch):
+    async def fetch_github_info(
+        session, url, scopes, branches, tag_prefixes, readme_hint, tag_depths=None
+    ):
+        return {"metadata": {"name": url}}
+
+    monkeypatch.setattr(crawl_module, "fetch_github_info", fetch_github_info)
+    monkeypatch.setattr(crawl_module, "SHARED_INFOS", 2)
+    session = aiohttp.ClientSession()
+    try:
+        urls = [f"https://github.com/example/P{i}" for i in range(4)]
+        for url in urls:
+            await crawl_module.fetch_info(session, url, {"METADATA"})
+        await crawl_module.fetch_info(session, urls[2], {"METADATA"})
+        await crawl_module.fetch_info(session, urls[0], {"METADATA"})
+
+        cached = [key[0] for key in crawl_module._repo_infos[session]]
+        assert cached == [urls[2], urls[0]]
+    finally:
+        await session.close()
+
+
+def fake_repo_info(url, id, tags=()):
+    async def no_tags():
+        for tag in tags:
+            yield tag
+
+    async def no_branch(name):
+        return None
+
+    return {
+        "metadata": {"id": id, "default_branch": "main"},
+        "tags": no_tags(),
+        "tags_with_prefix": lambda prefix: no_tags(),
+        "branch": no_branch,
+        "heads": f"{id}-head",
+    }
+
+
+@pytest.fixture
+def repos(monkeypatch):
+    events = []
+    ids = {}
+
+    async def fetch_info(
+        session, url, scopes, branches=(), tag_prefixes=(), readme_hint=None, tag_depths=None
+    ):
+        events.append("start")
+        await asyncio.sleep(0.01)
+        events.append("done")
+        tag = {
+            "name": "1.0.0", "url": f"{url}/1.0.0.zip", "date": "2024-01-01 00:00:00",
+            "sha": f"{url}@1.0.0",
+        }
+        return fake_repo_info(url, ids.get(url, url), [tag])
+
+    monkeypatch.setattr(crawl_module, "fetch_info", fetch_info)
+    return events, ids
+
+
+MULTI_REPO_PACKAGE = {
+    "name": "Multi",
+    "details": "https://github.com/example/Multi",
+    "releases": [
+        {"sublime_text": "<4000", "base": "https://gitlab.com/example/Old", "tags": True},
+        {"sublime_text": ">=4000", "base": "https://bitbucket.org/example/New", "tags": True},
+    ],
+    "source": "https://example.com/repository.json",
+    "schema_version": "3.0.0",
+}
+
+
+async def test_crawl_package_fetches_all_repositories_at_once(repos):
+    events, _ = repos
+    out = await crawl_module.crawl_package(None, MULTI_REPO_PACKAGE, {"name": "Multi"})
+
+    assert events == ["start"] * 3 + ["done"] * 3
+    assert {r["url"] for r in out["releases"]} == {
+        "https://gitlab.com/example/Old/1.0.0.zip",
+        "https://bitbucket.org/example/New/1.0.0.zip",
+    }
+    assert {r["sha"] for r in out["releases"]} == {
+        "https://gitlab.com/example/Old@1.0.0",
+        "https://bitbucket.org/example/New@1.0.0",
+    }
+    assert out["tag_depths"] == {
+        "https://gitlab.com/example/Old": {"": 1},
+        "https://bitbucket.org/example/New": {"": 1},
+    }
+    assert out["id"] == MULTI_REPO_PACKAGE["details"]
+
+
+async def test_crawl_package_still_detects_a_heart_attack(repos):
+    _, ids = repos
+    ids[MULTI_REPO_PACKAGE["details"]] = "someone-else"
+    existing = {"name": "Multi", "id": MULTI_REPO_PACKAGE["details"],
+                "details": MULTI_REPO_PACKAGE["details"]}
+
+    with pytest.raises(crawl_module.HeartAttack):
+        await crawl_module.crawl_package(None, MULTI_REPO_PACKAGE, existing)
@@ -0,0 +1,298 @@
+import asyncio
+import os
+import re
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts import github
+from scripts.github import TAGS, build_batch_query, query_repository
+
+
+def test_build_batch_query_aliases_and_renames_variables():
+    query, variables = build_batch_query([
+        ([TAGS], {"owner": "a", "name": "b", "tags_after": None, "unused": 1}),
+        ([TAGS], {"owner": "c", "name": "d", "tags_after": "xyz"}),
+    ])
+
+    assert "r0: repository(owner: $owner_0, name: $name_0)" in query
+    assert "r1: repository(owner: $owner_1, name: $name_1)" in query
+    assert "after: $tags_after_1" in query
+    assert variables == {
+        "owner_0": "a", "name_0": "b", "tags_after_0": None,
+        "owner_1": "c", "name_1": "d", "tags_after_1": "xyz",
+    }
+
+
+def test_batched_queries_use_every_variable_they_declare():
+    queries = [
+        [github.METADATA, TAGS, github.README_PROBES, github.HEADS],
+        [github.ROOT_TREE, github.BRANCHES, github.branch_query(0), github.tags_query("tags_0")],
+    ]
+    query, _ = build_batch_query((q, {"owner": "a", "name": "b"}) for q in queries)
+
+    declared = re.findall(r'\$(\w+):', query)
+    assert declared
+    for name in declared:
+        # GraphQL rejects the whole operation if any of them is unused
+        assert len(re.findall(rf'\${name}\b', query)) > 1, name
+
+
+class FakeSession:
+    pass
+
+
+class FakeResponse:
+    request_info = None
+    history = ()
+    headers: dict = {}
+
+
+@pytest.fixture
+def fake_post(monkeypatch):
+    calls = []
+
+    async def post_graphql(session, query, variables):
+        calls.append(variables)
+        n = len([k for k in variables if k.startswith("owner_")])
+        data = {
+            f"r{i}": {"name": variables[f"name_{i}"]}
+            for i in range(n)
+            if variables[f"name_{i}"] != "missing"
+        }
+        errors = [
+            {"type": "NOT_FOUND", "message": "Could not resolve", "path": [f"r{i}"]}
+            for i in range(n)
+            if variables[f"name_{i}"] == "missing"
+        ]
+        return {"data": data, **({"errors": errors} if errors else {})}, FakeResponse()
+
+    monkeypatch.setattr(github, "post_graphql", post_graphql)
+    return calls
+
+
+async def test_concurrent_queries_are_sent_as_one_batch(fake_post):
+    session = FakeSession()
+    results = await asyncio.gather(
+        *[
+            query_repository(session, [], {"owner": "o", "name": name})
+            for name in ("one", "missing", "three")
+        ],
+        return_exceptions=True
+    )
+
+    assert len(fake_post) == 1
+    assert results[0]["repository"] == {"name": "one"}
+    assert isinstance(results[1], github.GraphQLClientError)
+    assert results[1].status == 404
+    assert results[2]["repository"] == {"name": "three"}
+
+
+async def test_branches_are_resolved_from_the_initial_query(monkeypatch):
+    calls = []
+
+    async def query_repository(session, sub_queries, variables):
+        calls.append(variables)
+        commit = {"oid": "abc", "committedDate": "2024-01-02T03:04:05Z"}
+        return {
+            "repository": {
+                "defaultBranchRef": {"name": "main", "target": commit},
+                "branch_0": {"name": "dev", "target": commit},
+                "branch_1": None,
+            },
+            "rate_limit_info": {},
+        }
+
+    monkeypatch.setattr(github, "query_repository", query_repository)
+    info = await github.fetch_github_info(
+        FakeSession(), "https://github.com/o/r", (), branches=["dev", "gone"]
+    )
+
+    assert calls[0]["branch_0"] == "refs/heads/dev"
+    assert (await info["branch"]("main"))["url"] == "https://codeload.github.com/o/r/zip/main"
+    assert (await info["branch"]("dev"))["version"] == "2024.01.02.03.04.05"
+    assert await info["branch"]("gone") is None
+    assert len(calls) == 1
+
+
+async def test_prefixed_tags_are_filtered_on_the_server(monkeypatch):
+    calls = []
+
+    async def query_repository(session, sub_queries, variables):
+        calls.append(variables)
+        commit = {"oid": "abc", "committedDate": "2024-01-02T03:04:05Z"}
+        page = {"pageInfo": {"hasNextPage": False}, "nodes": [
+            {"name": "st4-1.0.0", "target": commit}
+        ]}
+        return {"repository": {"tags_0": page}, "rate_limit_info": {}}
+
+    monkeypatch.setattr(github, "query_repository", query_repository)
+    info = await github.fetch_github_info(
+        FakeSession(), "https://github.com/o/r", (), tag_prefixes=["st4-"]
+    )
+
+    assert calls[0]["tags_0_query"] == "st4-"
+    assert [tag["name"] async for tag in info["tags_with_prefix"]("st4-")] == ["st4-1.0.0"]
+    assert len(calls) == 1
+
+
+async def test_concurrent_iterations_share_the_pages_of_a_pager(monkeypatch):
+    calls = []
+
+    async def query_repository(session, sub_queries, variables):
+        calls.append(variables["tags_after"])
+        await asyncio.sleep(0.01)
+        page = int(variables["tags_after"] or 0)
+        commit = {"oid": "abc", "committedDate": "2024-01-02T03:04:05Z"}
+        return {"repository": {"tags": {
+            "pageInfo": {"hasNextPage": page < 2, "endCursor": str(page + 1)},
+            "nodes": [{"name": f"1.0.{page}", "target": commit}]
+        }}}
+
+    monkeypatch.setattr(github, "query_repository", query_repository)
+    pager = github.TagPager(FakeSession(), "o", "r")
+
+    async def names():
+        return [tag["name"] async for tag in pager]
+
+    first, second = await asyncio.gather(names(), names())
+    assert first == second == ["1.0.0", "1.0.1", "1.0.2"]
+    assert calls == [None, "1", "2"]
+
+
+def test_token_pool_picks_the_token_with_the_most_points_left(monkeypatch, tmp_path):
+    tokens_file = tmp_path / "tokens"
+    tokens_file.write_text("# spare tokens\nccc\naaa\n")
+    monkeypatch.setenv("GITHUB_TOKEN", "aaa")
+    monkeypatch.setenv("GITHUB_TOKENS", "bbb, aaa")
+    monkeypatch.setenv("GITHUB_TOKENS_FILE", str(tokens_file))
+    pool = github.TokenPool.from_env()
+    assert [token.value for token in pool.tokens] == ["aaa", "bbb", "ccc"]
+
+    def info(remaining, reset_in=3600):
+        return {
+            "limit": 5000, "remaining": remaining, "used": 5000 - remaining,
+            "reset": int(time.time()) + reset_in, "resource": "graphql", "reset_formatted": ""
+        }
+
+    a, b, c = pool.tokens
+    # Tokens we haven't used yet are tried first
+    a.update(info(4000))
+    b.update(info(100))
+    assert pool.pick() is c
+    c.update(info(3000))
+    assert pool.pick() is a
+    assert pool.summary()["remaining"] == 7100
+
+    # Used up tokens are parked until their reset
+    a.update(info(0))
+    c.update(info(0))
+    assert pool.pick() is b
+    b.update(info(0))
+    with pytest.raises(github.RateLimitExhausted):
+        pool.pick()
+    a.update(info(0, reset_in=-1))
+    assert pool.pick() is a
+
+
+@pytest.fixture
+def readme_repo(monkeypatch):
+    queries = []
+
+    async def query_repository(session, sub_queries, variables):
+        sub_queries = list(sub_queries)
+        queries.append(sub_queries)
+        repository = {
+            "defaultBranchRef": {"name": "main"},
+            "head": {"target": {"oid": "head-2"}},
+            "createdAt": "2020-01-01T00:00:00Z",
+        }
+        if github.README_PROBES in sub_queries:
+            repository["readme_3"] = {"oid": "blob"}  # README.rst
+        return {"repository": repository, "rate_limit_info": {}}
+
+    monkeypatch.setattr(github, "query_repository", query_repository)
+    return queries
+
+
+async def test_readme_location_is_remembered_per_head(readme_repo):
+    url = "https://github.com/o/r"
+    info = await github.fetch_github_info(
+        FakeSession(), url, ["METADATA"], readme_hint=("head-2", "https://cached/README.md")
+    )
+    assert info["metadata"]["readme"] == "https://cached/README.md"
+    assert len(readme_repo) == 1
+    assert github.README_PROBES not in readme_repo[0]
+    assert github.ROOT_TREE not in readme_repo[0]
+
+
+async def test_readme_is_probed_for_along_with_the_metadata_if_unknown(readme_repo):
+    url = "https://github.com/o/r"
+    info = await github.fetch_github_info(FakeSession(), url, ["METADATA"])
+    assert info["metadata"]["readme"] == "https://raw.githubusercontent.com/o/r/main/README.rst"
+    assert info["readme_key"] == "head-2"
+    assert len(readme_repo) == 1
+    assert github.README_PROBES in readme_repo[0]
+
+
+async def test_outdated_readme_location_is_kept_for_one_more_crawl(readme_repo):
+    url = "https://github.com/o/r"
+    info = await github.fetch_github_info(
+        FakeSession(), url, ["METADATA"], readme_hint=("head-1", "https://cached/README.md")
+    )
+    assert info["metadata"]["readme"] == "https://cached/README.md"
+    # Without a key, the next crawl probes for it (ref: crawl_package)
+    assert info["readme_key"] is None
+    assert len(readme_repo) == 1
+    assert github.README_PROBES not in readme_repo[0]
+
+
+def test_tags_page_size_follows_the_depth_of_the_last_match():
+    assert github.tags_page_size(None) == github.TAGS_PAGE_SIZE
+    assert github.tags_page_size(1) == github.MIN_TAGS_PAGE_SIZE
+    assert github.tags_page_size(20) == 40
+    assert github.tags_page_size(250) == github.TAGS_PAGE_SIZE
+
+
+async def test_first_page_of_tags_is_sized_by_the_last_match(monkeypatch):
+    seen = []
+
+    async def query_repository(session, sub_queries, variables):
+        seen.append(variables)
+        return {"repository": {}, "rate_limit_info": {}}
+
+    monkeypatch.setattr(github, "query_repository", query_repository)
+    url = "https://github.com/o/r"
+    await github.fetch_github_info(
+        FakeSession(), url, ["TAGS"], tag_prefixes=["st4-", "st3-"],
+        tag_depths={"": 3, "st4-": 40}
+    )
+    assert seen[0]["tags_first"] == 6
+    assert seen[0]["tags_0_first"] == 80
+    assert "tags_1_first" not in seen[0]
+
+
+async def test_heads_cover_the_named_branches(monkeypatch):
+    st3 = {"oid": "st3-1"}
+
+    async def query_repository(session, sub_queries, variables):
+        repository = {
+            "head": {"target": {"oid": "main-1"}},
+            "latest_tag": {"nodes": [{"name": "v1.0.0", "target": {"oid": "tag-1"}}]},
+        }
+        for name, value in variables.items():
+            if value == "refs/heads/st3":
+                repository[name] = {"name": "st3", "target": st3}
+        return {"repository": repository, "rate_limit_info": {}}
+
+    monkeypatch.setattr(github, "query_repository", query_repository)
+    url = "https://github.com/o/r"
+    before = await github.fetch_github_heads(FakeSession(), url, ["st3", "gone"])
+    assert before == "main-1 v1.0.0@tag-1 refs/heads/gone@ refs/heads/st3@st3-1"
+    assert github.branches_of_heads(before) == ["gone", "st3"]
+    assert await github.fetch_github_heads(FakeSession(), url, ["gone", "st3"]) == before
+
+    st3["oid"] = "st3-2"
+    assert await github.fetch_github_heads(FakeSession(), url, ["st3", "gone"]) != before
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts import gitlab
+
+
+class FakeSession:
+    pass
+
+
+def project_node(path, id):
+    return {
+        "id": f"gid://gitlab/Project/{id}",
+        "name": path.split("/")[1],
+        "webUrl": f"https://gitlab.com/{path}",
+        "fullPath": path,
+        "lastActivityAt": "2024-01-01T00:00:00Z",
+        "namespace": {"path": path.split("/")[0]},
+        "repository": {
+            "rootRef": "main",
+            "tree": {
+                "lastCommit": {"sha": "abc", "committedDate": "2024-01-01T00:00:00Z"},
+                "blobs": {"nodes": [
+                    {"name": "LICENSE", "type": "blob"},
+                    {"name": "README.md", "type": "blob"},
+                ]},
+            },
+        },
+    }
+
+
+@pytest.fixture
+def graphql(monkeypatch):
+    posts = []
+
+    async def post_graphql(session, query, variables):
+        posts.append(variables)
+        await asyncio.sleep(0)
+        return {"data": {"projects": {"nodes": [
+            project_node(path, i) for i, path in enumerate(variables["fullPaths"])
+            if path != "example/renamed"
+        ]}}}
+
+    monkeypatch.setattr(gitlab, "post_graphql", post_graphql)
+    monkeypatch.setattr(gitlab, "USE_GRAPHQL", True)
+    return posts
+
+
+async def test_concurrent_projects_share_one_graphql_query(graphql):
+    session = FakeSession()
+    foo, bar = await asyncio.gather(
+        gitlab.fetch_gitlab_info(session, "https://gitlab.com/example/Foo", ["METADATA"]),
+        gitlab.fetch_gitlab_info(session, "https://gitlab.com/example/Bar", ["METADATA"]),
+    )
+
+    assert graphql == [{"fullPaths": ["example/foo", "example/bar"], "first": 2}]
+    assert foo["metadata"]["id"] == "0"
+    assert bar["metadata"]["id"] == "1"
+    assert foo["metadata"]["readme"] == "https://gitlab.com/example/Foo/-/raw/main/README.md"
+    assert foo["readme_key"] == "2024-01-01T00:00:00Z"
+    # The head of the default branch came along, no REST request for it
+    assert (await foo["branch"]("main"))["sha"] == "abc"
+
+
+async def test_projects_missing_from_graphql_fall_back_to_rest(graphql, monkeypatch):
+    async def fetch_repo_metadata(session, owner, repo, readme_hint=None):
+        return {"id": "42", "default_branch": "master"}, "key"
+
+    monkeypatch.setattr(gitlab, "fetch_repo_metadata", fetch_repo_metadata)
+    info = await gitlab.fetch_gitlab_info(
+        FakeSession(), "https://gitlab.com/example/renamed", ["METADATA"]
+    )
+
+    assert info["metadata"] == {"id": "42", "default_branch": "master"}
+    assert info["readme_key"] == "key"
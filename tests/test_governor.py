@@ -0,0 +1,59 @@
+import asyncio
+import os
+import sys
+
+import aiohttp
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.governor import Governor
+
+
+def http_error(status):
+    return aiohttp.ClientResponseError(
+        request_info=None, history=(), status=status, message="Oops"
+    )
+
+
+async def test_window_grows_while_healthy_and_halves_on_throttling():
+    governor = Governor("api.example.com", initial=4, maximum=8)
+    for _ in range(40):
+        async with governor.slot():
+            pass
+    assert int(governor.window) == 8
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        async with governor.slot():
+            raise http_error(429)
+    assert int(governor.window) == 4
+
+    # Permanent errors of a single request say nothing about the host
+    with pytest.raises(aiohttp.ClientResponseError):
+        async with governor.slot():
+            raise http_error(404)
+    assert int(governor.window) == 4
+
+
+async def test_window_limits_the_requests_in_flight():
+    governor = Governor("api.example.com", initial=2)
+    running = 0
+    most = 0
+
+    async def request():
+        nonlocal running, most
+        async with governor.slot():
+            running += 1
+            most = max(most, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(request() for _ in range(10)))
+    assert most <= 3
+    assert governor.in_flight == 0
+
+
+def test_latency_spikes_back_off():
+    governor = Governor("api.example.com", initial=8)
+    governor.observe(0.5)
+    governor.observe(5.0)
+    assert int(governor.window) == 4
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import sys
+import time
+
+from multidict import CIMultiDict
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.ratelimit import RateLimiter, parse_rate_limit_headers
+
+
+def test_gitlab_and_bitbucket_headers_are_understood():
+    reset = int(time.time()) + 30
+    gitlab = parse_rate_limit_headers(CIMultiDict({
+        "RateLimit-Limit": "2000", "RateLimit-Remaining": "1990", "RateLimit-Reset": str(reset)
+    }))
+    assert gitlab == {"limit": 2000, "remaining": 1990, "reset": reset}
+
+    bitbucket = parse_rate_limit_headers(CIMultiDict({
+        "X-RateLimit-Limit": "1000", "X-RateLimit-NearLimit": "false"
+    }))
+    assert bitbucket == {"limit": 1000, "near_limit": False}
+
+    relative = parse_rate_limit_headers(CIMultiDict({"RateLimit-Reset": "60"}))
+    assert abs(relative["reset"] - (time.time() + 60)) < 2
+
+
+def test_the_rate_follows_the_points_left():
+    limiter = RateLimiter("gitlab.com")
+    limiter.update(CIMultiDict({
+        "RateLimit-Remaining": "100", "RateLimit-Reset": str(int(time.time()) + 100)
+    }))
+    assert 0.9 < limiter.rate <= 1.1
+
+    limiter = RateLimiter("api.bitbucket.org", rate=1.0)
+    limiter.update(CIMultiDict({"X-RateLimit-Limit": "1000", "X-RateLimit-NearLimit": "true"}))
+    assert limiter.rate == 1000 / 3600 / 2
+
+
+async def test_requests_are_paced_after_the_burst(monkeypatch):
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    limiter = RateLimiter("example.com", rate=10, burst=2)
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    for _ in range(3):
+        await limiter.acquire()
+
+    assert len(slept) == 1
+    assert 0 < slept[0] <= 0.1
+    assert limiter.requests == 3
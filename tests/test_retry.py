@@ -0,0 +1,64 @@
+import os
+import sys
+
+import aiohttp
+import pytest
+from multidict import CIMultiDict, CIMultiDictProxy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts import retry as retry_module
+from scripts.retry import deadline, with_retry
+
+
+def http_error(status, **headers):
+    return aiohttp.ClientResponseError(
+        request_info=None, history=(), status=status, message="Oops",
+        headers=CIMultiDictProxy(CIMultiDict(headers))
+    )
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(retry_module.asyncio, "sleep", sleep)
+    return slept
+
+
+def failing(*errors, result="ok"):
+    errors = list(errors)
+
+    async def call():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return call
+
+
+async def test_transient_errors_are_retried(sleeps):
+    call = failing(http_error(503), aiohttp.ServerDisconnectedError())
+    assert await with_retry(call) == "ok"
+    assert len(sleeps) == 2
+    assert all(0 <= s <= 2 for s in sleeps)
+
+
+async def test_permanent_errors_are_raised_right_away(sleeps):
+    with pytest.raises(aiohttp.ClientResponseError):
+        await with_retry(failing(http_error(404)))
+    assert sleeps == []
+
+
+async def test_retry_after_and_secondary_rate_limits_are_honored(sleeps):
+    call = failing(http_error(429, **{"Retry-After": "7"}), http_error(403, **{"Retry-After": "3"}))
+    assert await with_retry(call) == "ok"
+    assert sleeps == [7, 3]
+
+
+async def test_no_retry_past_the_deadline(sleeps):
+    with deadline(5):
+        with pytest.raises(aiohttp.ClientResponseError):
+            await with_retry(failing(http_error(503, **{"Retry-After": "60"})))
+    assert sleeps == []
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.utils import parse_timestamp
+from scripts import workspace as workspace_module
+from scripts.workspace import copy_workspace, open_workspace
+
+
+WORKSPACE = {
+    "packages": {
+        "Foo": {"name": "Foo", "source": "https://a", "next_crawl": "2024-01-01 00:00:00"},
+        "Bar": {
+            "name": "Bar", "source": "https://b", "removed": "2024-01-01 00:00:00",
+            "changes": ["2023-06-01 00:00:00", "2023-12-01 00:00:00"],
+        },
+    },
+    "dependencies": [],
+}
+
+
+def test_import_and_export_round_trip(tmp_path):
+    json_path = tmp_path / "workspace.json"
+    json_path.write_text(json.dumps(WORKSPACE))
+
+    copy_workspace(str(json_path), str(tmp_path / "workspace.sqlite"))
+    copy_workspace(str(tmp_path / "workspace.sqlite"), str(tmp_path / "export.json"))
+
+    assert json.loads((tmp_path / "export.json").read_text()) == WORKSPACE
+
+
+def test_sqlite_only_writes_changed_entries(tmp_path):
+    path = str(tmp_path / "workspace.sqlite")
+    with open_workspace(path) as store:
+        store.save(WORKSPACE)
+
+    with open_workspace(path) as store:
+        workspace = store.load()
+        workspace["packages"]["Foo"] = {
+            **workspace["packages"]["Foo"], "next_crawl": parse_timestamp("2024-01-02 00:00:00")
+        }
+        workspace["packages"]["Baz"] = {"name": "Baz"}
+        del workspace["packages"]["Bar"]
+        assert workspace["packages"].changed() == (
+            [
+                ("Foo", {**WORKSPACE["packages"]["Foo"], "next_crawl": 1704153600}),
+                ("Baz", {"name": "Baz"}),
+            ],
+            ["Bar"]
+        )
+        store.save(workspace)
+        assert workspace["packages"].changed() == ([], [])
+
+    with open_workspace(path) as store:
+        packages = store.load()["packages"]
+        assert sorted(packages) == ["Baz", "Foo"]
+        assert packages["Foo"]["next_crawl"] == 1704153600
+
+
+def test_json_store_appends_changes_to_the_journal(tmp_path):
+    path = tmp_path / "workspace.json"
+    path.write_text(json.dumps(WORKSPACE))
+
+    with open_workspace(str(path)) as store:
+        workspace = store.load()
+        foo = workspace["packages"]["Foo"]
+        workspace["packages"]["Foo"] = {**foo, "next_crawl": foo["next_crawl"] + 24 * 3600}
+        del workspace["packages"]["Bar"]
+        store.save(workspace)
+
+    assert json.loads(path.read_text()) == WORKSPACE
+    journal = tmp_path / "workspace.journal.jsonl"
+    assert len(journal.read_text().splitlines()) == 2
+
+    with open_workspace(str(path)) as store:
+        workspace = store.load()
+        assert dict(workspace["packages"]) == {
+            "Foo": {**WORKSPACE["packages"]["Foo"], "next_crawl": 1704153600}
+        }
+        store.compact(workspace)
+
+    assert not journal.exists()
+    assert json.loads(path.read_text())["packages"] == {
+        "Foo": {**WORKSPACE["packages"]["Foo"], "next_crawl": "2024-01-02 00:00:00"}
+    }
+
+
+def test_json_store_only_serializes_assigned_entries(tmp_path, monkeypatch):
+    path = tmp_path / "workspace.json"
+    path.write_text(json.dumps(WORKSPACE))
+    serialized = []
+    serialize = workspace_module.serialize
+    monkeypatch.setattr(
+        workspace_module, "serialize", lambda entry: serialized.append(entry) or serialize(entry)
+    )
+
+    with open_workspace(str(path)) as store:
+        workspace = store.load()
+        workspace["packages"]["Baz"] = {"name": "Baz"}
+        store.save(workspace)
+        store.save(workspace)
+
+    assert serialized == [{"name": "Baz"}]
+
+
+def test_json_store_recovers_from_an_interrupted_journal_write(tmp_path):
+    path = tmp_path / "workspace.json"
+    path.write_text(json.dumps(WORKSPACE))
+    journal = tmp_path / "workspace.journal.jsonl"
+    journal.write_text('{"name":"Foo","next_crawl":"2024-01-02 00:00:00"}\n{"name":"Ba')
+
+    with open_workspace(str(path)) as store:
+        workspace = store.load()
+        assert workspace["packages"]["Foo"]["next_crawl"] == 1704153600
+        workspace["packages"]["Baz"] = {"name": "Baz"}
+        store.save(workspace)
+
+    with open_workspace(str(path)) as store:
+        assert sorted(store.load()["packages"]) == ["Bar", "Baz", "Foo"]